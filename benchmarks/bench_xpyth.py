@@ -0,0 +1,234 @@
+"""
+Benchmarks for xpyth: translation latency for each comprehension shape covered
+by the unit tests, and query() throughput against synthetic HTML documents,
+compared with evaluating the equivalent hand-written XPath directly.
+
+Everything is generated on the fly, so no network access or fixtures are needed.
+
+    python benchmarks/bench_xpyth.py [--sizes 1000 10000 ...] [--json results.json]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import random
+import sys
+import timeit
+
+from lxml import etree
+
+from xpyth import DOM, X, xpath, query, first, exists, translation_cache, evaluator_cache
+
+
+# Comprehension shapes from tests/unit/test_xpyth.py, as functions returning a fresh generator
+TRANSLATION_SHAPES = (
+    ('tag', lambda: (div for div in DOM)),
+    ('nested tag', lambda: (span for div in DOM for span in div)),
+    ('attribute projection', lambda: (span.cls for div in DOM for span in div)),
+    ('text projection', lambda: (span.text for span in DOM)),
+    ('equality', lambda: (span for span in DOM if span.name == 'main')),
+    ('outer condition', lambda: (div for span in DOM if span.name == 'main' for div in span)),
+    ('hoisted condition', lambda: (div for span in DOM for div in span if span.name == 'main')),
+    ('conditions on both', lambda: (div for span in DOM if span.name == 'main' for div in span if div.cls == 'row')),
+    ('dissected and', lambda: (div for span in DOM for div in span if div.cls == 'row' and span.name == 'main')),
+    ('and', lambda: (a for a in DOM if a.href == 'http://www.google.com' and a.name == 'goog')),
+    ('contains', lambda: (a for a in DOM if '.com' in a.href)),
+    ('not in', lambda: (a for a in DOM if '.com' not in a.href)),
+    ('not contains', lambda: (a for a in DOM if not '.com' in a.href)),
+    ('inequality', lambda: (div for div in DOM if div.id != 'main')),
+    ('negated equality', lambda: (div for div in DOM if not div.id == 'main')),
+    ('wildcard', lambda: (X for X in DOM if X.name == 'main')),
+    ('axes', lambda: (span for div in DOM for X in div.following_siblings for span in X.children)),
+    ('any', lambda: (a.href for a in DOM if any(p for p in a.following_siblings))),
+    ('any with condition', lambda: (a.href for a in DOM if any(p for p in a.following_siblings if p.id))),
+    ('absolute any', lambda: (X for X in DOM if any(p for p in DOM))),
+    ('in tuple', lambda: (span for div in DOM for span in div if div.id in ('main', 'other'))),
+    ('in longer tuple', lambda: (X for X in DOM if X.name in ('a', 'b', 'c'))),
+    ('all', lambda: (X for X in DOM if all(p for p in X if p.id == 'a'))),
+    ('absolute all', lambda: (X for X in DOM if all(p for p in DOM if p.id == 'a'))),
+    ('any of comparison', lambda: (X for X in DOM if any(p.id == 'a' for p in X))),
+    ('all of negation', lambda: (X for X in DOM if all(not p.id == 'a' for p in X))),
+    ('all of negated inequality', lambda: (X for X in DOM if all(not p.id != 'a' for p in X))),
+    ('len', lambda: (X for X in DOM if len(td for td in X.following_siblings) == 0)),
+    ('len and condition', lambda: (td.text for td in DOM if td.cls == 'wideonly' and len(td for td in td.following_siblings) == 0)),
+    ('dashed attribute', lambda: (X for X in DOM if X.data-bind == 'a')),
+    ('dashed projection', lambda: (X.data-bind for X in DOM)),
+)
+
+
+# Comprehensions over a document, alongside the XPath one would otherwise write by hand
+QUERY_SHAPES = (
+    ('links', lambda tree: (a for a in tree), '//a'),
+    ('filtered hrefs', lambda tree: (a.href for a in tree if a.cls == 'external'), "//a[@class='external']/@href"),
+    ('nested', lambda tree: (li for div in tree if div.cls == 'section' for li in div), "//div[@class='section']//li"),
+    ('any', lambda tree: (div for div in tree if any(a for a in div if a.cls == 'internal')), "//div[.//a[@class='internal']]"),
+    ('text', lambda tree: (h2.text for h2 in tree), '//h2/text()'),
+)
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+
+# Ways of asking for a query's leading matches, against a document of paragraphs, most of which match
+LEADING_SHAPES = (
+    ('all', lambda tree: query(p for p in tree if p.cls == 'match')),
+    ('limit=20', lambda tree: query((p for p in tree if p.cls == 'match'), limit=20)),
+    ('first', lambda tree: first(p.id for p in tree if p.cls == 'match')),
+    ('exists', lambda tree: exists(p for p in tree if p.cls == 'match')),
+)
+
+DEFAULT_LEADING_SIZE = 300000
+
+# A condition on a subquery independent of the element tested, which every link in the document satisfies
+HOISTED_SHAPE = lambda tree: (li for li in tree if any(a for a in DOM if a.href))
+HOISTED_SUBQUERY = '//a[@href]'
+DEFAULT_HOISTING_SIZE = 60000
+
+
+def generate_document(nodes, seed=0):
+    """A synthetic HTML document of (approximately) the given number of elements."""
+    rng = random.Random(seed)
+    parts = ['<html><head><title>Benchmark</title></head><body>']
+    count = 5
+    section = 0
+    while count < nodes:
+        links = rng.randint(1, 4)
+        items = rng.randint(1, 6)
+        parts.append('<div class="section" id="s{}"><h2>Section {}</h2><p class="lead">'.format(section, section))
+        for link in range(links):
+            parts.append('<a href="http://example.com/{}/{}" class="{}">link</a> '.format(
+                section, link, rng.choice(('external', 'internal')),
+            ))
+        parts.append('</p><ul>')
+        parts.extend('<li data-bind="item{}">Item {}</li>'.format(item, item) for item in range(items))
+        parts.append('</ul></div>')
+        count += 4 + links + items
+        section += 1
+    parts.append('</body></html>')
+    return etree.fromstring(''.join(parts), etree.HTMLParser())
+
+
+def best(function, number, repeat):
+    """Fastest time, in seconds, of a single call to function."""
+    return min(timeit.Timer(function).repeat(repeat, number)) / number
+
+
+def bench_translation(number, repeat):
+    results = []
+    for name, shape in TRANSLATION_SHAPES:
+        def cold():
+            translation_cache.clear()
+            evaluator_cache.clear()
+            xpath(shape())
+
+        def warm():
+            xpath(shape())
+
+        results.append({
+            'shape': name,
+            'expression': xpath(shape()),
+            'cold_us': best(cold, number, repeat) * 1e6,
+            'warm_us': best(warm, number, repeat) * 1e6,
+        })
+    return results
+
+
+def bench_queries(sizes, repeat):
+    results = []
+    for size in sizes:
+        tree = generate_document(size)
+        number = max(1, 10000 // size)
+        for name, shape, expression in QUERY_SHAPES:
+            assert xpath(shape(DOM)) == expression, (name, xpath(shape(DOM)))
+            handwritten = etree.XPath('.' + expression)
+            expected = handwritten(tree)
+            assert query(shape(tree)) == expected, name
+            xpyth_seconds = best(lambda: query(shape(tree)), number, repeat)
+            lxml_seconds = best(lambda: handwritten(tree), number, repeat)
+            results.append({
+                'size': size,
+                'shape': name,
+                'results': len(expected),
+                'xpyth_ms': xpyth_seconds * 1e3,
+                'lxml_ms': lxml_seconds * 1e3,
+                'overhead': xpyth_seconds / lxml_seconds,
+            })
+    return results
+
+
+def bench_leading(size, repeat):
+    tree = etree.fromstring('<html><body>{}</body></html>'.format(''.join(
+        '<p id="p{}" class="{}">text</p>'.format(i, 'skip' if i % 10 == 0 else 'match') for i in range(size)
+    )), etree.HTMLParser())
+    results = []
+    for name, shape in LEADING_SHAPES:
+        results.append({
+            'size': size,
+            'shape': name,
+            'xpyth_ms': best(lambda: shape(tree), 1, repeat) * 1e3,
+        })
+    return results
+
+
+def bench_hoisting(size, repeat):
+    """
+    query() of HOISTED_SHAPE, whose subquery is tested once and bound as a
+    boolean, against lxml binding the subquery's node-set instead, which
+    libxml2 copies for every element tested. (Leaving the subquery in the
+    predicate is slower still: it's evaluated again for every element.)
+    """
+    tree = generate_document(size)
+    bound = etree.XPath('.//li[$links]')
+    links = etree.XPath(HOISTED_SUBQUERY)
+    assert query(HOISTED_SHAPE(tree)) == bound(tree, links=links(tree))
+    return {
+        'size': size,
+        'links': len(links(tree)),
+        'xpyth_ms': best(lambda: query(HOISTED_SHAPE(tree)), 1, repeat) * 1e3,
+        'node_set_ms': best(lambda: bound(tree, links=links(tree)), 1, repeat) * 1e3,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='document sizes, in elements')
+    parser.add_argument('--leading-size', type=int, default=DEFAULT_LEADING_SIZE, help='document size, in elements, for leading matches')
+    parser.add_argument('--hoisting-size', type=int, default=DEFAULT_HOISTING_SIZE, help='document size, in elements, for hoisting')
+    parser.add_argument('--number', type=int, default=200, help='translations per timing run')
+    parser.add_argument('--repeat', type=int, default=5, help='timing runs, of which the fastest is kept')
+    parser.add_argument('--json', help='also write results to this file, for tracking over time')
+    args = parser.parse_args(argv)
+
+    translation = bench_translation(args.number, args.repeat)
+    print('{:<28} {:>10} {:>10}  {}'.format('translation', 'cold (us)', 'warm (us)', 'expression'))
+    for result in translation:
+        print('{shape:<28} {cold_us:>10.1f} {warm_us:>10.1f}  {expression}'.format(**result))
+    print()
+
+    queries = bench_queries(args.sizes, args.repeat)
+    print('{:>8} {:<16} {:>8} {:>11} {:>11} {:>9}'.format('elements', 'query', 'results', 'xpyth (ms)', 'lxml (ms)', 'overhead'))
+    for result in queries:
+        print('{size:>8} {shape:<16} {results:>8} {xpyth_ms:>11.3f} {lxml_ms:>11.3f} {overhead:>8.2f}x'.format(**result))
+
+    print()
+
+    leading = bench_leading(args.leading_size, args.repeat)
+    print('{:>8} {:<16} {:>11}'.format('elements', 'leading', 'xpyth (ms)'))
+    for result in leading:
+        print('{size:>8} {shape:<16} {xpyth_ms:>11.3f}'.format(**result))
+
+    print()
+
+    hoisting = bench_hoisting(args.hoisting_size, args.repeat)
+    print('{:>8} {:>8} {:>11} {:>16}'.format('elements', 'links', 'xpyth (ms)', 'node-set (ms)'))
+    print('{size:>8} {links:>8} {xpyth_ms:>11.3f} {node_set_ms:>16.3f}'.format(**hoisting))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'python': sys.version, 'translation': translation, 'queries': queries, 'leading': leading,
+                'hoisting': hoisting,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,8 +11,10 @@ setup(
     url='https://github.com/hchasestevens/xpyth',
     install_requires=[
         'lxml>=4.1.1',
-        'pony>=0.7.3',
     ],
+    entry_points={
+        'console_scripts': ['xpyth-compile = xpyth._precompile:main'],
+    },
     tests_require=['pytest>=3.1.2'],
     extras_require={'dev': ['pytest>=3.1.2']},
     keywords='xpath xml html',
@@ -0,0 +1,130 @@
+"""Unit tests for xpyth's ahead-of-time compilation."""
+
+import json
+import sys
+
+import pytest
+
+from lxml import etree
+
+import xpyth
+from xpyth import _aot, _precompile, translation_cache
+
+
+MODULE = '''
+from xpyth import DOM, xpath, query, query_many
+
+
+def links():
+    return xpath(a.href for a in DOM if a.cls == 'external')
+
+
+def items(tree):
+    return query(li for div in tree if div.id == 'main' for li in div)
+
+
+def many(tree):
+    return query_many({'a': (a.href for a in DOM), 'p': (p for p in DOM)}, tree)
+
+
+def dynamic(name):
+    return xpath(a for a in DOM if a.id == name)
+
+
+def broken():
+    return xpath(a for a in DOM if a.id.startswith('x'))
+
+
+def other():
+    return sorted(x for x in range(3))
+
+
+def residual(tree):
+    return query(a for a in tree if a.href.startswith('http'))
+'''
+
+
+@pytest.fixture
+def module(tmpdir):
+    path = tmpdir.join('queries.py')
+    path.write(MODULE)
+    namespace = {}
+    exec(compile(MODULE, str(path), 'exec'), namespace)
+    yield str(path), namespace
+    _aot.translations.clear()
+
+
+def test_compile(module, tmpdir, capsys):
+    """Ensure comprehensions are translated, unless they depend on captured values, and failures are reported."""
+    path, namespace = module
+    output = str(tmpdir.join('precompiled.json'))
+    assert _precompile.main([path, '-o', output]) == 1
+    out, err = capsys.readouterr()
+    assert out.strip() == '4 comprehensions translated, 2 left to runtime, 1 failed'
+    assert err.startswith('{}:22: NotImplementedError'.format(path))
+
+    with open(output) as f:
+        table = json.load(f)
+    assert sorted(entry[0] for entry in table[_aot.version()].values()) == [
+        "//a/@href", "//a[@class='external']/@href", "//div[@id='main']//li", '//p',
+    ]
+
+    # Runs for other Python versions are kept
+    table['other-1.0'] = {}
+    with open(output, 'w') as f:
+        json.dump(table, f)
+    _precompile.main([str(tmpdir), '-o', output])
+    with open(output) as f:
+        assert set(json.load(f)) == {'other-1.0', _aot.version()}
+
+
+def test_compile_hybrid(tmpdir, capsys):
+    """Ensure comprehensions with conditions left to Python are translated at runtime, rather than failing."""
+    path = tmpdir.join('hybrid.py')
+    path.write('''
+from xpyth import query, values
+
+
+def links(tree):
+    return query(a for a in tree if a.href.startswith('http'))
+
+
+def long_links(tree):
+    return values(a.href for a in tree if len(a.text) > 3)
+''')
+    output = str(tmpdir.join('precompiled.json'))
+    assert _precompile.main([str(path), '-o', output]) == 0
+    out, err = capsys.readouterr()
+    assert out.strip() == '0 comprehensions translated, 2 left to runtime, 0 failed'
+    assert not err
+
+
+def test_load(module, tmpdir, monkeypatch):
+    """Ensure precompiled translations are used without decompiling anything."""
+    path, namespace = module
+    output = str(tmpdir.join('precompiled.json'))
+    _precompile.main([path, '-o', output])
+    assert xpyth.load_precompiled(output) == 4
+
+    def decompile(code):
+        raise AssertionError('decompiled')
+    monkeypatch.setattr(xpyth, 'decompile', decompile)
+    translation_cache.clear()
+    tree = etree.fromstring('<html><div id="main"><li>1</li><a href="x"/></div><p/></html>')
+    assert namespace['links']() == "//a[@class='external']/@href"
+    assert [li.text for li in namespace['items'](tree)] == ['1']
+    assert namespace['many'](tree)['a'] == ['x']
+    with pytest.raises(AssertionError):
+        namespace['dynamic']('x')
+
+
+def test_lookup_options(module, tmpdir):
+    """Ensure precompiled translations are only used with the options they were made with."""
+    path, namespace = module
+    output = str(tmpdir.join('precompiled.json'))
+    _precompile.main([path, '-o', output])
+    xpyth.load_precompiled(output)
+    code, = [const for const in namespace['links'].__code__.co_consts if hasattr(const, 'co_code')]
+    assert _aot.lookup(code).expression == "//a[@class='external']/@href"
+    assert _aot.lookup(code, variables=True) is None
+    assert _aot.lookup(code, membership=True) is None
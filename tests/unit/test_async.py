@@ -0,0 +1,90 @@
+"""Unit tests for xpyth's asyncio API."""
+
+import sys
+import threading
+
+import pytest
+
+if sys.version_info < (3, 5):
+    pytest.skip('asyncio API requires Python 3.5+', allow_module_level=True)
+
+import asyncio
+import concurrent.futures
+
+from lxml import etree
+
+from xpyth import DOM, AsyncPool, aquery, aquery_many
+
+
+DOCUMENT = '<html><body><div id="main"><a href="x">X</a><a href="y">Y</a></div><p>text</p></body></html>'
+
+
+class CountingExecutor(concurrent.futures.ThreadPoolExecutor):
+    """Thread pool which records the most work it was given at once."""
+
+    def __init__(self, *args, **kwargs):
+        super(CountingExecutor, self).__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.pending = self.most_pending = 0
+
+    def submit(self, *args, **kwargs):
+        with self.lock:
+            self.pending += 1
+            self.most_pending = max(self.most_pending, self.pending)
+        future = super(CountingExecutor, self).submit(*args, **kwargs)
+        future.add_done_callback(self.done)
+        return future
+
+    def done(self, future):
+        with self.lock:
+            self.pending -= 1
+
+
+def run(awaitable):
+    """Runs awaitable to completion on a fresh event loop; a callable is called for it on that loop."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(awaitable() if callable(awaitable) else awaitable)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def test_aquery():
+    """Ensure markup and trees are queried in the executor, as by query() and values()."""
+    results = run(aquery((a for div in DOM if div.id == 'main' for a in div), DOCUMENT))
+    assert [a.get('href') for a in results] == ['x', 'y']
+    assert run(aquery((p.text for p in DOM), DOCUMENT)) == ['text']
+    assert run(aquery((a.href for a in DOM), '<r><a href="z"/></r>', html=False)) == ['z']
+
+    href = 'y'
+    tree = etree.fromstring(DOCUMENT)
+    results = run(aquery((a.text for a in DOM if a.href == href), tree, variables=True, values=True))
+    assert results == ['Y'] and type(results[0]) is str
+
+
+def test_aquery_many():
+    """Ensure several comprehensions are evaluated against a single parse."""
+    results = run(aquery_many({
+        'links': (a.href for div in DOM if div.id == 'main' for a in div),
+        'texts': (a.text for div in DOM if div.id == 'main' for a in div),
+        'paragraphs': (p for p in DOM),
+    }, DOCUMENT))
+    assert results['links'] == ['x', 'y']
+    assert results['texts'] == ['X', 'Y']
+    assert [p.text for p in results['paragraphs']] == ['text']
+
+
+def test_backpressure():
+    """Ensure no more than max_pending queries are handed to the executor at once."""
+    pool = AsyncPool(CountingExecutor(4), max_pending=2)
+    try:
+        documents = ['<html><p>{}</p></html>'.format(i) for i in range(20)]
+        results = run(lambda: asyncio.gather(*[
+            aquery((p.text for p in DOM), document, pool=pool) for document in documents
+        ]))
+    finally:
+        pool.close()
+    assert results == [[str(i)] for i in range(20)]
+    assert pool.executor.most_pending <= 2
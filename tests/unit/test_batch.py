@@ -0,0 +1,66 @@
+"""Unit tests for batch queries in worker processes."""
+
+import pytest
+
+from xpyth import DOM, query_batch
+
+
+DOCUMENTS = [
+    '<html><body><div id="d{0}"><a href="a{0}">A</a><a href="b{0}">B</a></div><p>{0}</p></body></html>'.format(i)
+    for i in range(10)
+]
+
+
+@pytest.fixture
+def paths(tmpdir):
+    paths = []
+    for i, document in enumerate(DOCUMENTS):
+        path = tmpdir.join('{}.html'.format(i))
+        path.write(document)
+        paths.append(str(path))
+    return paths
+
+
+def test_query_batch(paths):
+    """Ensure each file's results are returned, in order, as plain strings."""
+    results = query_batch((a.href for a in DOM), paths, workers=2, chunksize=3)
+    assert list(results) == [['a{}'.format(i), 'b{}'.format(i)] for i in range(10)]
+
+
+def test_elements():
+    """Ensure elements are returned as their markup."""
+    results = query_batch((p for p in DOM), iter(DOCUMENTS), workers=2, markup=True)
+    assert list(results) == [['<p>{}</p>'.format(i)] for i in range(10)]
+
+
+def test_sources(paths):
+    """Ensure markup and paths give the same results, both being queried from their root element."""
+    for comprehension in (
+        lambda: (X.tag for X in DOM),
+        lambda: (html for html in DOM),
+        lambda: (a.href for body in DOM for a in body),
+    ):
+        from_paths = list(query_batch(comprehension(), paths[:2], workers=1))
+        assert list(query_batch(comprehension(), DOCUMENTS[:2], workers=1, markup=True)) == from_paths
+    assert from_paths == [['a0', 'b0'], ['a1', 'b1']]
+
+
+def test_unordered(paths):
+    """Ensure unordered results are paired with their source's index."""
+    wanted = ['d1', 'd7']
+    results = query_batch(
+        (a.text for div in DOM if div.id in wanted for a in div), paths, workers=2, chunksize=1, ordered=False,
+        membership=True,
+    )
+    assert sorted(results) == [(i, ['A', 'B'] if i in (1, 7) else []) for i in range(10)]
+
+
+def test_errors(paths):
+    """Ensure translation errors are raised straight away, and parsing errors where they occur."""
+    with pytest.raises(NotImplementedError):
+        query_batch((a for a in DOM if a.href.startswith('a')), paths)
+
+    results = query_batch((a.href for a in DOM), paths[:1] + ['/nonexistent.html'], workers=1, chunksize=1)
+    assert next(results) == ['a0', 'b0']
+    with pytest.raises(IOError):
+        next(results)
@@ -0,0 +1,82 @@
+"""Unit tests for querying documents from files."""
+
+import sys
+import threading
+
+import pytest
+
+from lxml import etree
+
+from xpyth import DOM, query, query_file
+from xpyth import _files
+
+
+@pytest.fixture
+def paths(tmpdir):
+    paths = []
+    for i in range(3):
+        path = tmpdir.join('{}.html'.format(i))
+        path.write('<html><body><a href="a{0}">A</a><p><a href="b{0}">B</a></p></body></html>'.format(i))
+        paths.append(str(path))
+    return paths
+
+
+def test_query_file(paths):
+    """Ensure a file's document is parsed and queried."""
+    assert query_file((a.href for a in DOM), paths[0]) == ['a0', 'b0']
+    links, = query_file((a for p in DOM for a in p), paths[1])
+    assert links.get('href') == 'b1'
+
+    href = 'b2'
+    assert [a.text for a in query_file((a for a in DOM if a.href == href), paths[2], variables=True)] == ['B']
+
+
+def test_context(paths):
+    """Ensure files are queried from their root element, as query() queries trees."""
+    tree = etree.parse(paths[0]).getroot()
+    assert query_file((html for html in DOM), paths[0]) == query(html for html in tree) == []
+    assert [X.tag for X in query_file((X for X in DOM), paths[0])] == [X.tag for X in query(X for X in tree)]
+    body, = query_file((body for body in DOM), paths[0])
+    assert body.tag == 'body'
+    assert query_file((a.href for body in DOM for a in body), paths[0]) == ['a0', 'b0']
+
+
+def test_paths(paths):
+    """Ensure several files are queried in turn, with values optionally free of their trees."""
+    results = query_file((a.href for a in DOM), iter(paths), values=True)
+    assert not isinstance(results, list)
+    results = list(results)
+    assert results == [['a0', 'b0'], ['a1', 'b1'], ['a2', 'b2']]
+    assert all(type(href) is str for hrefs in results for href in hrefs)
+
+
+@pytest.mark.skipif(sys.version_info < (3, 6), reason="os.PathLike")
+def test_path_objects(paths):
+    """Ensure path-like objects are accepted."""
+    import pathlib
+    assert query_file((a.href for p in DOM for a in p), pathlib.Path(paths[0])) == ['b0']
+
+
+def test_xml(tmpdir):
+    """Ensure XML documents are parsed with the given options."""
+    path = tmpdir.join('document.xml')
+    path.write('<root>\n  <item id="1"/>\n  <item id="2">two</item>\n</root>')
+    assert query_file((item.id for item in DOM), str(path), html=False) == ['1', '2']
+    first = query_file((item for item in DOM), str(path), html=False)[0]
+    assert first.tail.strip() == ''
+    first = query_file((item for item in DOM), str(path), html=False, parser_options={'remove_blank_text': True})[0]
+    assert first.tail is None
+
+
+def test_parsers():
+    """Ensure parsers are created once per thread and set of options."""
+    parser = _files.parser(html=False, huge_tree=True)
+    assert _files.parser(html=False, huge_tree=True) is parser
+    assert _files.parser(html=False) is not parser
+    assert _files.parser(html=True, huge_tree=True) is not parser
+
+    others = []
+    thread = threading.Thread(target=lambda: others.append(_files.parser(html=False, huge_tree=True)))
+    thread.start()
+    thread.join()
+    assert others[0] is not parser
@@ -0,0 +1,88 @@
+"""Unit tests for xpyth's document indexes."""
+
+import pytest
+
+from lxml import etree
+
+from xpyth import X, DocumentIndex, query, values
+from xpyth import _index
+
+
+DOCUMENT = '''
+<html>
+    <div id="main" class="a"><p id="x" class="b">1</p><p name="n" class="a">2</p></div>
+    <div id="x" class="c"><span class="a" id="s">3</span><p class="b">4</p></div>
+    <p id="main">5</p>
+</html>
+'''
+
+
+@pytest.mark.parametrize('expression,expected', (
+    ('//p', ('p', (), None)),
+    ("//*[@id='x']", ('*', (('id', 'literal', 'x'),), None)),
+    ("//p[@class='a' or @id=$k]/@id", ('p', (('class', 'literal', 'a'), ('id', 'variable', 'k')), '@id')),
+    ("//*[xpyth:member(@class, 'wanted')]/text()", ('*', (('class', 'member', 'wanted'),), 'text()')),
+    ("//div//p", None),
+    ("//p[@id='x' and @class='b']", None),
+    ("//p[@id!='x']", None),
+    ("//p[@id='x'][@class='b']", None),
+    ("//p[contains(@id, 'x')]", None),
+    ("//p[./@id='x']", None),
+))
+def test_plan(expression, expected):
+    """Ensure only single steps testing attribute equality are recognised."""
+    assert _index.plan(expression) == expected
+
+
+def test_index():
+    """Ensure indexed queries return just what XPath evaluation would."""
+    tree = etree.fromstring(DOCUMENT)
+    index = DocumentIndex(etree.ElementTree(tree))
+    assert len(index) == 7
+
+    k = 'x'
+    wanted = ['b', 'c', 'missing']
+    queries = (
+        lambda: (X for X in tree if X.id == k),
+        lambda: (p for p in tree),
+        lambda: (X for X in tree),
+        lambda: (p.id for p in tree if p.cls == 'a' or p.id == 'main'),
+        lambda: (X.text for X in tree if X.cls in ('a', 'b')),
+        lambda: (X for X in tree if X.name == 'n'),
+        lambda: (X for X in tree if X.lang == 'en'),  # not indexed
+        lambda: (span for div in tree for span in div),  # not indexable
+    )
+    for comprehension in queries:
+        assert query(comprehension(), index=index) == query(comprehension())
+    for variables in (False, True):
+        assert query((X for X in tree if X.id == k), variables=variables, index=index) == query(X for X in tree if X.id == k)
+    assert (
+        query((X.id for X in tree if X.cls in wanted), membership=True, index=index)
+        == query(X.id for X in tree if X.cls in wanted)
+        == ['x', 'x']
+    )
+    projection = values((X.text for X in tree if X.cls in ('a', 'b')), index=index)
+    assert projection == ['1', '2', '3', '4'] and all(type(text) is str for text in projection)
+    assert query((X for X in tree if X.id == k), limit=1, index=index) == query(X for X in tree if X.id == k)[:1]
+
+    one = 1
+    assert query((X for X in tree if X.id == one), variables=True, index=index) == []  # numeric comparison
+
+
+def test_index_elsewhere():
+    """Ensure an index is only consulted for the document it was built from."""
+    tree = etree.fromstring(DOCUMENT)
+    other = etree.fromstring('<html><p id="x"/></html>')
+    index = DocumentIndex(tree)
+    assert [p.get('id') for p in query((p for p in other if p.id == 'x'), index=index)] == ['x']
+    assert index.evaluate(None, {}, {}, other) is None
+
+
+def test_nested():
+    """Ensure text is returned in document order when one match contains another."""
+    tree = etree.fromstring('<html><div class="a">a<p class="a">b</p>c</div><p>d</p></html>')
+    index = DocumentIndex(tree)
+    assert query((X.text for X in tree), index=index) == ['a', 'b', 'c', 'd']
+    assert query((X.text for X in tree if X.cls == 'a'), index=index) == ['a', 'b', 'c']
+    assert query((p.text for p in tree), index=index) == ['b', 'd']
+    assert query((X.cls for X in tree), index=index) == ['a', 'a']
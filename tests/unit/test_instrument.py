@@ -0,0 +1,107 @@
+"""Unit tests for xpyth's instrumentation hooks."""
+
+import logging
+
+import pytest
+
+from lxml import etree
+
+from xpyth import (
+    DOM, Instrument, Counters, SlowQueryLog, add_instrument, remove_instrument,
+    compile, query, query_many, translation_cache,
+)
+
+
+DOCUMENT = '<html><p id="a">1</p><p id="b">2</p><span id="a"/></html>'
+
+
+class Recorder(Instrument):
+    def __init__(self):
+        self.events = []
+
+    def phase(self, name, seconds, code):
+        self.events.append(('phase', name))
+
+    def translated(self, code, expression, cached):
+        self.events.append(('translated', expression, cached))
+
+    def evaluated(self, code, expression, results, seconds):
+        self.events.append(('evaluated', expression, len(results)))
+
+
+@pytest.fixture
+def recorder():
+    translation_cache.clear()
+    recorder = add_instrument(Recorder())
+    yield recorder
+    remove_instrument(recorder)
+
+
+def test_phases(recorder):
+    """Ensure each phase of a query is reported, in order, and cached translations skip straight to evaluation."""
+    tree = etree.fromstring(DOCUMENT)
+    for __ in range(2):
+        query(p for p in tree if p.id == 'a')
+    assert recorder.events == [
+        ('phase', 'decompile'),
+        ('phase', 'translate'),
+        ('phase', 'compile'),
+        ('translated', "//p[@id='a']", False),
+        ('phase', 'evaluate'),
+        ('evaluated', "//p[@id='a']", 1),
+        ('translated', "//p[@id='a']", True),
+        ('phase', 'evaluate'),
+        ('evaluated', "//p[@id='a']", 1),
+    ]
+
+
+def test_compiled_and_many(recorder):
+    """Ensure precompiled queries and query_many report their evaluations."""
+    tree = etree.fromstring(DOCUMENT)
+    q = compile(p for p in DOM)
+    del recorder.events[:]
+    q(tree)
+    assert recorder.events == [('phase', 'evaluate'), ('evaluated', '//p', 2)]
+
+    del recorder.events[:]
+    query_many({'p': (p for p in DOM), 'span': (span for span in DOM)}, tree)
+    assert sorted(event for event in recorder.events if event[0] == 'evaluated') == [
+        ('evaluated', '//p', 2),
+        ('evaluated', '//span', 1),
+    ]
+
+
+def test_counters():
+    """Ensure counters tally translations, cache hits and results."""
+    translation_cache.clear()
+    counters = add_instrument(Counters())
+    try:
+        tree = etree.fromstring(DOCUMENT)
+        for __ in range(3):
+            query(p for p in tree)
+    finally:
+        remove_instrument(counters)
+    query(p for p in tree)  # no longer counted
+
+    totals = counters.snapshot()
+    assert (totals['translations'], totals['cache_hits']) == (1, 2)
+    assert totals['expression_length'] == len('//p')
+    assert (totals['evaluations'], totals['results']) == (3, 6)
+    assert all(totals['{}_seconds'.format(phase)] > 0 for phase in ('decompile', 'translate', 'compile', 'evaluate'))
+
+    counters.reset()
+    assert counters.snapshot()['evaluations'] == 0
+
+
+def test_slow_query_log(caplog):
+    """Ensure queries over the threshold are logged with their source and expression."""
+    log = add_instrument(SlowQueryLog(threshold=0))
+    try:
+        with caplog.at_level(logging.WARNING, logger='xpyth'):
+            query(p for p in etree.fromstring(DOCUMENT) if p.id == 'b')
+    finally:
+        remove_instrument(log)
+    message, = [record.getMessage() for record in caplog.records]
+    assert 'test_instrument.py' in message
+    assert "query(p for p in etree.fromstring(DOCUMENT) if p.id == 'b')" in message
+    assert message.endswith("-> //p[@id='b']")
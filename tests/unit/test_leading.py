@@ -0,0 +1,92 @@
+"""Unit tests for evaluating only a query's leading matches."""
+
+import pytest
+
+from lxml import etree
+
+from xpyth import X, evaluator_cache, exists, first, query, values
+from xpyth import _leading
+
+
+DOCUMENT = '''
+<html>
+    <div id="main"><p id="1">a<b>b</b>c</p><p id="2"><b>d</b></p><section><p id="3">e</p></section></div>
+    <div id="other"><p id="4">f</p><div id="inner"><p id="5">g</p></div></div>
+    <p id="6">h<span>i</span></p>
+    <!-- comment -->
+</html>
+'''
+
+
+@pytest.mark.parametrize('expression,expected', (
+    ('//p', (True, 'p', 'self::p', None)),
+    ("/div[@id='main']", (False, 'div', "self::div[@id='main']", None)),
+    ('//*/@id', (True, '*', 'self::*', '@id')),
+    (
+        "//div[@id='main']/p/text()",
+        (True, 'p', "self::p[parent::div[@id='main'][ancestor::*[count(. | $_xpyth_context) = 1]]]", 'text()'),
+    ),
+    ('/div//p', (True, 'p', 'self::p[ancestor::div[parent::*[count(. | $_xpyth_context) = 1]]]', None)),
+    ('//p[1]', None),
+    ('//p[last()]', None),
+    ('//div[position() > 1]//p', None),
+    ('//*[count(.//p)]', None),
+    ('//*[count(.//p) = 0]', (True, '*', 'self::*[count(.//p) = 0]', None)),
+    ('//p/following-sibling::p', None),
+    ('//p/..', None),
+))
+def test_plan(expression, expected):
+    """Ensure only child and descendant steps by name, without positional predicates, are planned."""
+    assert _leading.plan(expression) == expected
+
+
+def test_leading():
+    """Ensure the leading matches are just those of the full query."""
+    tree = etree.fromstring(DOCUMENT)
+    main, = query(div for div in tree if div.id == 'main')
+    wanted = ['2', '5', '6']
+    queries = (
+        lambda context: (p for p in context),
+        lambda context: (X for X in context),
+        lambda context: (X.id for X in context),
+        lambda context: (p.text for p in context),
+        lambda context: (p.id for div in context for p in div),
+        lambda context: (b.text for div in context if div.id == 'main' for p in div for b in p),
+        lambda context: (p for section in context for p in section if p.id == '3'),
+        lambda context: (p for p in context if p.id in wanted),
+        lambda context: (p for p in context if p.id.startswith('4') or p.id.endswith('5')),  # residual
+        lambda context: (X.text for X in context if len(X.id) == 1),  # residual, with text
+        lambda context: (p for p in context if any(div for div in context if div.id == 'inner')),  # hoisted
+        lambda context: (X for X in context if len(p for p in X) == 1),
+        lambda context: (X for X in context if len(p for p in X)),  # positional
+        lambda context: (X.text for X in context),  # nested matches
+        lambda context: (div for div in context for div in div),  # nested, then nested again
+    )
+    for context in (tree, main):
+        for comprehension in queries:
+            expected = query(comprehension(context), membership=True)
+            for limit in range(len(expected) + 2):
+                assert query(comprehension(context), membership=True, limit=limit) == expected[:limit]
+                assert values(comprehension(context), membership=True, limit=limit) == expected[:limit]
+            assert first(comprehension(context), membership=True) == (expected[0] if expected else None)
+            assert exists(comprehension(context), membership=True) == bool(expected)
+
+
+def test_early():
+    """Ensure candidates are tested one at a time, rather than the whole query being evaluated."""
+    tree = etree.fromstring('<html>{}</html>'.format(''.join('<p id="{0}">{0}</p>'.format(i) for i in range(50))))
+    evaluator_cache.clear()
+    assert [p.text for p in query((p for p in tree), limit=20)] == [str(i) for i in range(20)]
+    assert first(p.id for p in tree if '4' in p.id) == '4'
+    assert ("self::p[contains(@id, '4')]", True) in evaluator_cache._entries
+    assert ('@id', True) in evaluator_cache._entries
+
+
+def test_rare(monkeypatch):
+    """Ensure a search which finds too few matches gives way to evaluating the query in full."""
+    monkeypatch.setattr(_leading, '_SPARE', 2)
+    tree = etree.fromstring('<html>{}</html>'.format(''.join('<p id="{0}">{0}</p>'.format(i) for i in range(50))))
+    assert first(p.id for p in tree if p.id == '2') == '2'
+    assert first(p.id for p in tree if p.id == '40') == '40'
+    assert query((p.id for p in tree if '4' in p.id), limit=3) == ['4', '14', '24']
+    assert not exists(p for p in tree if p.id == '50')
@@ -0,0 +1,73 @@
+"""Unit tests for xpyth's expression optimizer."""
+
+import pytest
+
+from lxml import etree
+
+from xpyth import DOM, X, xpath, query, first, compile, evaluator_cache
+from xpyth import _optimize
+
+
+@pytest.mark.parametrize('expression,expected', (
+    ('//*[count(./following-sibling::td)=0]', '//*[not(./following-sibling::td)]'),
+    ('//*[count(.//p) != 0]', '//*[boolean(.//p)]'),
+    ('//*[count(.//p)>0]/@id', '//*[boolean(.//p)]/@id'),
+    ('//*[count(.//p)=0.5]', '//*[count(.//p)=0.5]'),
+    ('//*[count(.//p)=2]', '//*[count(.//p)=2]'),
+    ("//*[@name='count(.//p)=0']", "//*[@name='count(.//p)=0']"),
+    ('//*[count(.//p[count(.//b)=0])=0]', '//*[not(.//p[not(.//b)])]'),
+    ('//*//span', '/*//span'),
+    ('//div//*//span[@id]', '//div/*//span[@id]'),
+    ("//a[@href='//*//']", "//a[@href='//*//']"),
+))
+def test_optimize(expression, expected):
+    """Ensure expressions are rewritten into cheaper equivalents, leaving literals alone."""
+    assert _optimize.optimize(expression) == expected
+
+
+@pytest.mark.parametrize('expression,expected,hoisted', (
+    ('//*[//p]', '//*[$_xpyth_h0]', (('_xpyth_h0', 'boolean(//p)'),)),
+    ("//*[not(//p[not(@id='a')])]", '//*[not($_xpyth_h0)]', (('_xpyth_h0', "boolean(//p[not(@id='a')])"),)),
+    ('//*[@id and //p[//q]]', '//*[@id and $_xpyth_h1]', (
+        ('_xpyth_h0', 'boolean(//q)'), ('_xpyth_h1', 'boolean(//p[$_xpyth_h0])'),
+    )),
+    ("//*[//p or @id='a']/@id", "//*[$_xpyth_h0 or @id='a']/@id", (('_xpyth_h0', 'boolean(//p)'),)),
+    ('//*[//p/@id]', '//*[$_xpyth_h0]', (('_xpyth_h0', 'boolean(//p/@id)'),)),
+    ('//*[count(//td)=2 and @id]', '//*[count(//td)=2 and @id]', ()),  # node-sets would be copied per node
+    ("//*[//p/@id='a']", "//*[//p/@id='a']", ()),
+    ("//*[@id=//p/@id]", "//*[@id=//p/@id]", ()),
+    ("//*[contains(//p, 'a')]", "//*[contains(//p, 'a')]", ()),
+    ('//*[//p | //q]', '//*[//p | //q]', ()),
+    ('//p[.//b]//q', '//p[.//b]//q', ()),
+    ("//p[@href='//q']", "//p[@href='//q']", ()),
+))
+def test_hoist(expression, expected, hoisted):
+    """Ensure tests of absolute subqueries are moved out of predicates as booleans, and nothing else is."""
+    assert _optimize.hoist(expression) == (expected, hoisted)
+
+
+def test_conjunct_order():
+    """Ensure conjuncts are ordered cheapest first, and disjunctions among them are parenthesized."""
+    assert xpath(X for X in DOM if any(p for p in X) and X.id == 'a') == "//*[@id='a' and .//p]"
+    assert (
+        xpath(X for X in DOM if len(p for p in DOM) == 1 and 'b' in X.cls and X.id == 'a')
+        == "//*[@id='a' and contains(@class, 'b') and count(//p)=1]"
+    )
+    assert xpath(a for a in DOM if (a.x == '1' or a.y == '2') and a.z == '3') == "//a[(@x='1' or @y='2') and @z='3']"
+    assert xpath(a for a in DOM if any(b for b in a) and (a.x == '1' or a.y == '2')) == "//a[(@x='1' or @y='2') and .//b]"
+
+
+def test_hoisted_queries():
+    """Ensure queries with hoisted subqueries return the same results as unoptimized ones."""
+    tree = etree.fromstring('<html><div id="a"><p id="x"/></div><div id="b"><td/></div></html>')
+    evaluator_cache.clear()
+    results = query(div for div in tree if any(p for p in DOM if p.id == 'x'))
+    assert [div.get('id') for div in results] == ['a', 'b']
+    expressions = [expression for expression, __ in evaluator_cache._entries]
+    assert ".//div[$_xpyth_h0]" in expressions
+    assert "boolean(//p[@id='x'])" in expressions
+    assert query(div for div in tree if any(p for p in DOM if p.id == 'y')) == []
+    assert first(div for div in tree if all(p for p in DOM if p.id == 'x')).get('id') == 'a'
+
+    q = compile(X for X in DOM if len(td for td in DOM) == 1 and X.id)
+    assert [X.get('id') for X in q(tree)] == ['a', 'x', 'b']
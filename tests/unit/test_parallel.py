@@ -0,0 +1,107 @@
+"""Unit tests for xpyth's parallel queries."""
+
+import multiprocessing.pool
+
+import pytest
+
+from lxml import etree
+
+from xpyth import DOM, X, parallel_query, query
+from xpyth import _parallel
+
+
+DOCUMENT = '''
+<html>
+    <head><title>t</title></head>
+    <body>
+        {}
+    </body>
+</html>
+'''.format(''.join(
+    '<div class="{0}" id="d{1}"><p id="p{1}">{1}<b>b</b></p><div class="inner"><p>x{1}</p></div></div>'.format(
+        'odd' if i % 2 else 'even', i,
+    )
+    for i in range(40)
+))
+
+
+@pytest.fixture
+def pool():
+    pool = multiprocessing.pool.ThreadPool(3)
+    yield pool
+    pool.close()
+
+
+@pytest.mark.parametrize('expression,expected', (
+    ("//p", ('p', '', '')),
+    ("//div[@class='odd']//p/text()", ("div[@class='odd']", '//p', '/text()')),
+    ("//*[@id]/@id", ('*[@id]', '', '/@id')),
+    ("/html//p", None),
+    ("//p[./b]", None),
+    ("//p/following-sibling::div", None),
+    ("//p[1]", None),
+))
+def test_plan(expression, expected):
+    """Ensure only searches which stay within subtrees are split."""
+    assert _parallel.plan(expression) == expected
+
+
+def test_parallel_query(pool):
+    """Ensure split searches find just what query() does, in document order."""
+    tree = etree.fromstring(DOCUMENT)
+    wanted = 'odd'
+    comprehensions = (
+        lambda: (p for p in tree),
+        lambda: (p.text for div in tree if div.cls == 'odd' for p in div),
+        lambda: (X.id for X in tree if X.id),
+        lambda: (div for div in tree if div.cls == wanted),
+        lambda: (X for X in tree for p in X if p.id == 'p3'),  # further steps from body: not split
+        lambda: (p for p in tree if any(b for b in p)),  # not local: not split
+        lambda: (X for X in tree),
+        lambda: (X.text for X in tree),  # text of split elements: not split
+    )
+    for comprehension in comprehensions:
+        expected = query(comprehension())
+        assert parallel_query(comprehension(), workers=2, pool=pool) == expected
+        assert parallel_query(comprehension(), workers=8, pool=pool) == expected
+    assert parallel_query((div.id for div in tree if div.cls == wanted), variables=True, pool=pool) == query(
+        div.id for div in tree if div.cls == 'odd'
+    )
+    assert parallel_query(p for p in etree.fromstring('<html/>')) == []
+
+    mixed = etree.fromstring('<html><body>a<p>b</p>c<p>d</p>e</body></html>')
+    assert parallel_query((X.text for X in mixed), workers=1, pool=pool) == ['a', 'b', 'c', 'd', 'e']
+    assert parallel_query((p.text for p in mixed), workers=1, pool=pool) == ['b', 'd']
+
+
+def test_partitions():
+    """Ensure documents are split below elements with few children, and every element is covered once."""
+    tree = etree.fromstring(DOCUMENT)
+    partitions = _parallel._partitions(tree, 8)
+    assert [(element.tag, whole) for element, whole in partitions[:3]] == [('head', True), ('body', False), ('div', True)]
+    covered = [
+        descendant
+        for element, whole in partitions
+        for descendant in (element.iter() if whole else [element])
+    ]
+    assert covered == list(tree.iterdescendants())
+
+
+def test_default_pool():
+    """Ensure the default pool is shut down cleanly when the interpreter exits."""
+    import os
+    import subprocess
+    import sys
+
+    import xpyth
+
+    code = (
+        'from lxml import etree; from xpyth import parallel_query; '
+        'print(parallel_query(p.id for p in etree.fromstring("<html><body><p id=\\"a\\"/></body></html>")))'
+    )
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(xpyth.__file__))))
+    process = subprocess.Popen([sys.executable, '-c', code], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    assert process.returncode == 0
+    assert out.decode().strip() == "['a']"
+    assert not err
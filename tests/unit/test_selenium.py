@@ -0,0 +1,106 @@
+"""Unit tests for xpyth's Selenium backend, against a fake driver backed by lxml."""
+
+import re
+
+import pytest
+
+from lxml import etree
+
+import xpyth
+from xpyth import DOM, X, query_many
+
+
+DOCUMENT = '''
+<html>
+    <div id="main"><a href="x">X</a><a href="y">Y</a><p>text</p></div>
+    <div id="other"><a href="z">Z</a></div>
+    <div id="C:\\dir"><a>backslash</a></div>
+    <div id="a&quot;b'c"><a>quotes</a></div>
+</html>
+'''
+
+
+class FakeElement(object):
+    def __init__(self, parent, element):
+        self.parent = parent
+        self.element = element
+
+
+class FakeDriver(object):
+    """Runs xpyth's script's XPath evaluations with lxml, counting round trips."""
+
+    def __init__(self, document):
+        self.tree = etree.ElementTree(etree.fromstring(document))
+        self.scripts = []
+
+    def execute_script(self, script, expressions, context):
+        assert 'document.evaluate' in script
+        self.scripts.append(expressions)
+        context = self.tree if context is None else context.element
+        return [
+            [
+                FakeElement(self, result) if isinstance(result, etree._Element) else str(result)
+                for result in context.xpath(expression)
+            ]
+            for expression in expressions
+        ]
+
+
+def test_query():
+    """Ensure elements and projections are returned from a single round trip each."""
+    driver = FakeDriver(DOCUMENT)
+    links = xpyth.compile(a.href for div in DOM if div.id == 'main' for a in div)
+    assert links(driver) == ['x', 'y']
+    assert driver.scripts == [[".//div[@id='main']//a/@href"]]
+
+    paragraphs = xpyth.compile(p for p in DOM)
+    assert [p.element.text for p in paragraphs(driver)] == ['text']
+
+    main, = xpyth.compile(X for X in DOM if X.id == 'main')(driver)
+    assert xpyth.compile(a.text for a in DOM)(main) == ['X', 'Y']
+    assert len(driver.scripts) == 4  # one per query
+
+
+def test_variables():
+    """Ensure variables are inlined as literals, as browsers can't bind them."""
+    driver = FakeDriver(DOCUMENT)
+    div_id = 'main'
+    links = xpyth.compile(a.text for div in DOM if div.id == div_id for a in div)
+    assert links(driver) == ['X', 'Y']
+    assert links(driver, div_id='other') == ['Z']
+    assert links(driver, div_id="it's") == []
+    assert driver.scripts[-1] == ['.//div[@id="it\'s"]//a/text()']
+    assert links(driver, div_id='C:\\dir') == ['backslash']
+    assert links(driver, div_id='a"b\'c') == ['quotes']
+    assert driver.scripts[-1] == ['''.//div[@id=concat('a"b', "'", 'c')]//a/text()''']
+
+    allowed = ['x']
+    members = xpyth.compile((a for a in DOM if a.href in allowed), membership=True)
+    with pytest.raises(NotImplementedError):
+        members(driver)
+
+
+def test_regular_expressions():
+    """Ensure re:test() is rejected before reaching the browser, while literals that mention it are sent."""
+    driver = FakeDriver(DOCUMENT)
+    matching = xpyth.compile(a for a in DOM if re.search('^[xy]$', a.href))
+    with pytest.raises(NotImplementedError):
+        matching(driver)
+    with pytest.raises(NotImplementedError):
+        query_many({'matching': (a for a in DOM if re.match('z', a.href)), 'all': (a for a in DOM)}, driver)
+    assert driver.scripts == []
+    assert xpyth.compile(a.text for a in DOM if a.href == 're:test(')(driver) == []
+
+
+def test_query_many():
+    """Ensure several comprehensions are evaluated in a single round trip."""
+    driver = FakeDriver(DOCUMENT)
+    results = query_many({
+        'hrefs': (a.href for a in DOM),
+        'texts': (a.text for div in DOM if div.id == 'other' for a in div),
+        'divs': (div for div in DOM),
+    }, driver)
+    assert results['hrefs'] == ['x', 'y', 'z']
+    assert results['texts'] == ['Z']
+    assert [div.element.get('id') for div in results['divs']] == ['main', 'other', 'C:\\dir', 'a"b\'c']
+    assert len(driver.scripts) == 1
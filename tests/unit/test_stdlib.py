@@ -0,0 +1,96 @@
+"""Unit tests for xpyth's xml.etree backend."""
+
+import xml.etree.ElementTree as ElementTree
+
+import pytest
+
+from lxml import etree
+
+from xpyth import DOM, X, query, first, query_many
+
+
+DOCUMENT = '''
+<html>
+    <div id='main' class='main'>
+        <a href='http://www.google.com'>Google</a>
+        <a href='http://www.chasestevens.com'>Not Google</a>
+        <p>Lorem ipsum</p>
+        <p id='123'>no numbers here</p>
+        <p id='numbers_only'>123<span>nested</span>tail</p>
+    </div>
+    <div id='123' class='secondary'>
+        <a href='http://www.google.org'>Google Charity</a>
+        <a href='http://www.chasestevens.org'>Broken link!</a>
+        <div><p data-bind='1'>deep</p></div>
+    </div>
+</html>
+'''
+
+
+def normalize(results):
+    return [
+        result if isinstance(result, str) else (result.tag, sorted(result.attrib.items()), result.text)
+        for result in results
+    ]
+
+
+@pytest.mark.parametrize('comprehension', (
+    lambda tree: (a for a in tree),
+    lambda tree: (a.href for a in tree),
+    lambda tree: (p.text for p in tree),
+    lambda tree: (X for X in tree if X.id == '123'),
+    lambda tree: (X.id for X in tree if X.id != '123'),
+    lambda tree: (a for a in tree if 'Not Google' not in a.text),
+    lambda tree: (a for a in tree if '.com' in a.href and 'google' in a.href),
+    lambda tree: (p for div in tree if div.cls == 'secondary' for p in div),
+    lambda tree: (X for div in tree for X in div.children),
+    lambda tree: (X for div in tree if div.id == 'main' for X in div.children if X.id),
+    lambda tree: (a.href for a in tree if any(p for p in a.following_siblings)),
+    lambda tree: (a.href for a in tree if not any(p for p in a.following_siblings)),
+    lambda tree: (p for p in tree if any(div for div in p.ancestors if div.id == '123')),
+    lambda tree: (X for X in tree if X.name in ('main', 'secondary')),
+    lambda tree: (div for div in tree if all(p for p in div if p.id)),
+    lambda tree: (div for div in tree if len(a for a in div.children) == 0),
+    lambda tree: (X for X in tree if X.data-bind == '1'),
+    lambda tree: (X for X in tree if any(p for p in tree)),
+))
+def test_stdlib_backend(comprehension):
+    """Ensure xml.etree elements are queried with the same results as lxml elements."""
+    lxml_results = query(comprehension(etree.fromstring(DOCUMENT)))
+    stdlib_results = query(comprehension(ElementTree.fromstring(DOCUMENT)))
+    assert normalize(stdlib_results) == normalize(lxml_results)
+
+
+MIXED = '<html><div>a<p>b<b>c</b>d</p>e<div>f<p>g</p></div>h</div><p>i</p>j</html>'
+
+
+@pytest.mark.parametrize('comprehension', (
+    lambda tree: (X.text for X in tree),
+    lambda tree: (X.text for div in tree for X in div),
+    lambda tree: (X.text for div in tree for X in div.children),
+    lambda tree: (p.text for div in tree for p in div),
+    lambda tree: (div.text for div in tree),
+    lambda tree: (X for X in tree if X.text == 'd'),
+))
+def test_stdlib_backend_mixed(comprehension):
+    """Ensure text is returned in document order when selected elements contain one another."""
+    lxml_results = query(comprehension(etree.fromstring(MIXED)))
+    stdlib_results = query(comprehension(ElementTree.fromstring(MIXED)))
+    assert normalize(stdlib_results) == normalize(lxml_results)
+
+
+def test_stdlib_backend_options():
+    """Ensure variables, limits and query_many work against xml.etree elements."""
+    tree = ElementTree.fromstring(DOCUMENT)
+    div_id = '123'
+    assert [div.get('class') for div in query((div for div in tree if div.id == div_id), variables=True)] == ['secondary']
+    assert first(a.href for a in tree) == 'http://www.google.com'
+    assert query((a for a in tree), limit=3)[-1].text == 'Google Charity'
+    assert query_many({'main': (div for div in DOM if div.id == 'main')}, tree)['main'][0].get('class') == 'main'
+
+
+def test_stdlib_backend_unsupported():
+    """Ensure expressions outside of the supported subset are rejected."""
+    tree = ElementTree.fromstring(DOCUMENT)
+    with pytest.raises(NotImplementedError):
+        query(a for a in tree if any(p for p in a.following))
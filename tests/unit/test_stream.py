@@ -0,0 +1,66 @@
+"""Unit tests for xpyth's streaming queries."""
+
+import io
+
+import pytest
+
+from xpyth import DOM, X, stream_query
+
+
+DOCUMENT = b'''
+<feed>
+    <entry id="1" lang="en"><title>First</title><link href="http://a.com"/></entry>
+    <entry id="2" lang="fr"><title>Second</title><link href="http://b.fr"/></entry>
+    <archive>
+        <entry id="3" lang="en"><title>Third</title><link href="http://c.com"/></entry>
+    </archive>
+</feed>
+'''
+
+
+def stream(comprehension):
+    return list(stream_query(comprehension, io.BytesIO(DOCUMENT)))
+
+
+@pytest.mark.parametrize('comprehension,expected', (
+    ((entry.id for entry in DOM), ['1', '2', '3']),
+    ((link.href for entry in DOM if entry.lang == 'en' for link in entry), ['http://a.com', 'http://c.com']),
+    ((title.text for feed in DOM for entry in feed.children if entry.id != '1' for title in entry.children), ['Second']),
+    ((title.text for title in DOM if 'ir' in title.text), ['First', 'Third']),
+    ((X.href for X in DOM if '.com' in X.href), ['http://a.com', 'http://c.com']),
+))
+def test_stream_query(comprehension, expected):
+    """Ensure matches are found incrementally."""
+    assert stream(comprehension) == expected
+
+
+def test_stream_query_clears_elements():
+    """Ensure elements are discarded once iteration has moved past them."""
+    titles = []
+    for title in stream_query((title for title in DOM), io.BytesIO(DOCUMENT)):
+        titles.append(title)
+        assert title.text
+    assert [title.text for title in titles] == [None, None, None]
+    assert titles[0].getparent() is None  # deleted from the tree once its successor ended
+
+
+def test_stream_query_memory():
+    """Ensure text predicates don't stop elements which can no longer match from being discarded."""
+    document = b'<feed>' + b''.join(b'\n<p>' + str(i).encode() + b'<b/>tail</p>' for i in range(1000)) + b'\n</feed>'
+    matches = 0
+    for p in stream_query((p for p in DOM if '5' in p.text), io.BytesIO(document)):
+        assert len(list(p.itersiblings(preceding=True))) <= 1  # only its predecessor, discarded once iteration resumes
+        matches += 1
+    assert matches == 271
+
+
+@pytest.mark.parametrize('comprehension', (
+    (a for a in DOM if any(p for p in a.following_siblings)),
+    (entry for feed in DOM if 'x' in feed.text for entry in feed),
+    (X for X in DOM if X.text == 'First'),
+    (X.text for X in DOM),
+))
+def test_stream_query_unsupported(comprehension):
+    """Ensure expressions that can't be evaluated in a single forward pass are rejected."""
+    with pytest.raises(NotImplementedError):
+        stream(comprehension)
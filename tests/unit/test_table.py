@@ -0,0 +1,82 @@
+"""Unit tests for xpyth's columnar extraction."""
+
+import xml.etree.ElementTree as ElementTree
+
+import pytest
+
+from lxml import etree
+
+from xpyth import DocumentIndex, evaluator_cache, query_table
+
+
+DOCUMENT = '''
+<html>
+    <div id="main">
+        <a href="x" title="first" data-id="1">X</a>
+        <a href="y">Y</a>
+        <a class="skip" href="z">Z</a>
+    </div>
+    <div id="other"><a href="w" title="last">W</a><a>no href</a></div>
+</html>
+'''
+
+
+@pytest.fixture(params=['lxml', 'xml.etree'])
+def tree(request):
+    if request.param == 'lxml':
+        return etree.fromstring(DOCUMENT)
+    return ElementTree.fromstring(DOCUMENT)
+
+
+def test_columns(tree):
+    """Ensure each field becomes a column, with a value (missing ones empty) per element."""
+    hrefs, texts, titles = query_table((a.href, a.text, a.title) for a in tree if not a.cls == 'skip')
+    assert hrefs == ['x', 'y', 'w', '']
+    assert texts == ['X', 'Y', 'W', 'no href']
+    assert titles == ['first', '', 'last', '']
+    assert all(type(href) is str for href in hrefs)
+
+    ids, = query_table((a.data-id,) for div in tree if div.id == 'main' for a in div)
+    assert ids == ['1', '', '']
+    assert query_table((a.href, a.text) for a in tree if a.href == 'nowhere') == ([], [])
+
+
+def test_expressions(tree):
+    """Ensure fields may be any Python expression of the element, and conditions needn't be XPath."""
+    suffix = '!'
+    elements, lengths, replaced = query_table(
+        (a, len(a.text), a.text.replace('Y', suffix)) for a in tree if a.href.startswith('y') or a.title == 'last'
+    )
+    assert [element.get('href') for element in elements] == ['y', 'w']
+    assert lengths == [1, 1]
+    assert replaced == ['!', 'W']
+
+
+def test_single_selection():
+    """Ensure the elements are selected by a single XPath evaluation, whatever the number of fields."""
+    tree = etree.fromstring(DOCUMENT)
+    evaluator_cache.clear()
+    query_table((a.href, a.text, a.title, a.cls) for a in tree)
+    assert {expression for expression, __ in evaluator_cache._entries} == {'.//a'}
+
+    index = DocumentIndex(tree)
+    assert query_table(((a.text, a.title) for a in tree if a.href == 'w'), index=index) == (['W'], ['last'])
+
+
+def test_unsupported():
+    """Ensure comprehensions which aren't of the selected node's fields are refused."""
+    tree = etree.fromstring(DOCUMENT)
+    with pytest.raises(NotImplementedError):
+        query_table(a.href for a in tree)
+    with pytest.raises(NotImplementedError):
+        query_table((div.id, a.href) for div in tree for a in div)
+
+
+def test_arrays():
+    """Ensure columns may be NumPy arrays."""
+    numpy = pytest.importorskip('numpy')
+    tree = etree.fromstring(DOCUMENT)
+    hrefs, lengths, elements = query_table(((a.href, len(a.text), a) for a in tree), arrays=True)
+    assert isinstance(hrefs, numpy.ndarray) and hrefs.tolist() == ['x', 'y', 'z', 'w', '']
+    assert lengths.tolist() == [1, 1, 1, 1, 7]
+    assert elements.dtype == object and elements.shape == (5,)
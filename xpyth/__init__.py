@@ -2,23 +2,59 @@ try:
     from functools import reduce
 except ImportError:
     pass
+try:
+    from collections.abc import Iterable
+except ImportError:
+    from collections import Iterable
 
-from pony.orm.decompiling import Decompiler
-from pony.thirdparty.compiler.ast import *
-from lxml import etree
-
-import ctypes
 import collections
-import functools
-
-
-__all__ = 'DOM X xpath query'.split()
+import importlib
+import os
+import re
+import sys
+import threading
+
+from xpyth import _instrument, _optimize, _paths
+from xpyth._decompiler import decompile
+from xpyth._instrument import Instrument, Counters, SlowQueryLog, add_instrument, remove_instrument
+from xpyth._nodes import *
+
+
+__all__ = '''
+    DOM X Query xpath query query_many query_table query_file query_batch values first exists stream_query
+    DocumentIndex parallel_query
+    translation_cache TranslationCache evaluator_cache load_precompiled
+    Instrument Counters SlowQueryLog add_instrument remove_instrument
+'''.split()
 __author__ = 'H. Chase Stevens'
 
 
 DEBUG = False
 
 
+class _LazyModule(object):
+    """Stand-in for a module which is only imported once one of its attributes is used."""
+
+    def __init__(self, name, on_import=None):
+        self.__name = name
+        self.__on_import = on_import
+
+    def __getattr__(self, attr):
+        module = sys.modules.get(self.__name)
+        if module is None or self.__on_import is not None:
+            module = importlib.import_module(self.__name)
+            if self.__on_import is not None:
+                on_import, self.__on_import = self.__on_import, None
+                on_import(module)
+        value = getattr(module, attr)
+        setattr(self, attr, value)
+        return value
+
+    def loaded(self):
+        """Whether the module has been imported, by us or anyone else."""
+        return self.__name in sys.modules
+
+
 class _DOM(object):
     def __iter__(self):
         return self
@@ -50,49 +86,675 @@ class X:
      self) = [None] * 15
 
 
-def xpath(g):
-    """Returns XPath expression corresponding to generator."""
-    assert g.gi_frame.f_locals['.0'] == DOM, "Only root-level expressions are supported."
-    ast = Decompiler(g.gi_code).ast
-    frame_locals = g.gi_frame.f_locals
-    frame_globals = g.gi_frame.f_globals
-    frame_globals.update(frame_locals)  # Any danger in this?
-    expression = _handle_genexpr(ast, frame_globals)
+class _LRUCache(object):
+    """Bounded mapping which discards its least recently used entries first."""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = self.misses = self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries[key] = value  # move to most recently used
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._entries:
+                del self._entries[key]
+            else:
+                self._added(key)
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                evicted, __ = self._entries.popitem(last=False)
+                self.evictions += 1
+                self._evicted(evicted)
+
+    def clear(self):
+        """Empty the cache and reset its counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def _added(self, key):
+        """Called, holding the lock, when key is first put."""
+
+    def _evicted(self, key):
+        """Called, holding the lock, when key is discarded to make room."""
+
+
+class TranslationCache(_LRUCache):
+    """
+    Cache of generated expressions, keyed on the generator's code object and
+    the values of any captured names the translation read.
+    """
+
+    def __init__(self, maxsize=256):
+        super(TranslationCache, self).__init__(maxsize)
+        self._dependencies = {}  # (code object, options) -> names read while translating it
+        self._counts = collections.Counter()  # (code object, options) -> entries cached for it
+
+    def lookup(self, code, options, namespace):
+        dependencies = self._dependencies.get((code, options))
+        if dependencies is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        return self.get(_cache_key(code, options, dependencies, namespace))
+
+    def store(self, code, options, scope, translation):
+        with self._lock:
+            reads, typed = self._dependencies.get((code, options), ((), ()))
+            reads = tuple(sorted(set(reads) | scope.reads))
+            typed = tuple(sorted((set(typed) | scope.typed) - set(reads)))
+            self._dependencies[code, options] = reads, typed
+        self.put(_cache_key(code, options, (reads, typed), scope.namespace), translation)
+
+    def clear(self):
+        super(TranslationCache, self).clear()
+        self._dependencies.clear()
+        self._counts.clear()
+
+    def _added(self, key):
+        self._counts[key[:2]] += 1
+
+    def _evicted(self, key):
+        # Once no entry for a code object is left, neither is its record, nor the reference to it
+        self._counts[key[:2]] -= 1
+        if not self._counts[key[:2]]:
+            del self._counts[key[:2]]
+            self._dependencies.pop(key[:2], None)
+
+
+class _PerThreadCache(object):
+    """
+    An LRU cache per thread, for values which mustn't be shared between threads.
+    Everything but maxsize, which applies to every thread's cache, concerns only
+    the calling thread's cache.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._local = threading.local()
+
+    def _cache(self):
+        try:
+            cache = self._local.cache
+        except AttributeError:
+            cache = self._local.cache = _LRUCache(self.maxsize)
+        cache.maxsize = self.maxsize
+        return cache
+
+    def __len__(self):
+        return len(self._cache())
+
+    def __getattr__(self, name):  # get, put, clear, hits, misses, evictions
+        return getattr(self._cache(), name)
+
+
+translation_cache = TranslationCache()
+evaluator_cache = _PerThreadCache()  # (expression, smart_strings) -> compiled etree.XPath, as these aren't thread-safe
+
+
+_SCALAR_TYPES = (type(u''), str, int, float)
+
+
+class _Namespace(object):
+    """Read-only view of a generator's variables: its locals, falling back to its globals."""
+
+    __slots__ = ('locals', 'globals')
+
+    def __init__(self, frame):
+        self.locals = frame.f_locals
+        self.globals = frame.f_globals
+
+    def __getitem__(self, name):
+        try:
+            return self.locals[name]
+        except KeyError:
+            return self.globals[name]
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+
+class _Scope(object):
+    """Names visible to the translator; records every name that is looked up."""
+
+    def __init__(self, namespace, targets=(), variables=False, membership=False, hybrid=False):
+        self.namespace = namespace
+        self.targets = frozenset(targets)  # comprehension variables, as opposed to captured names
+        self.variables = variables
+        self.membership = membership
+        self.hybrid = hybrid  # whether conditions XPath can't express may be left to Python
+        self.residual = None  # (conditions, target, projection) left to Python, if any
+        self.reads = set()  # names whose values the translation depends on
+        self.typed = set()  # names whose types (but not values) the translation depends on
+        self.bound = set()  # names referenced as XPath variables
+        self.members = set()  # names of iterables looked up by xpyth:member()
+
+    def get(self, name, default=None):
+        self.reads.add(name)
+        return self.namespace.get(name, default)
+
+    def capture(self, name):
+        """XPath for a captured scalar value, or None if name doesn't refer to one."""
+        if name in self.targets:
+            return None
+        if not self.variables:
+            return _literal(self.get(name, _MISSING))
+        self.typed.add(name)
+        if not isinstance(self.namespace.get(name, _MISSING), _SCALAR_TYPES):
+            return None
+        self.bound.add(name)
+        return '$' + name
+
+    def hashed(self, name):
+        """Name to look up a captured iterable by in xpyth:member(), or None if membership is off."""
+        if not self.membership or name in self.targets:
+            return None
+        self.typed.add(name)
+        value = self.namespace.get(name, _MISSING)
+        if isinstance(value, _SCALAR_TYPES) or not isinstance(value, Iterable):
+            return None
+        self.members.add(name)
+        return name
+
+
+_Translation = collections.namedtuple('_Translation', 'expression variables members hoisted query_expression residual')
+
+_XPYTH_NS = 'https://github.com/hchasestevens/xpyth'
+_NAMESPACES = {'xpyth': _XPYTH_NS, 're': 'http://exslt.org/regular-expressions'}
+
+_membership = threading.local()  # sets consulted by xpyth:member() during the current evaluation
+
+
+def _member(context, values, name):
+    """XPath extension function: whether any of values is in the named set."""
+    members = _membership.sets[name]
+    if not isinstance(values, list):
+        values = [values]
+    return any(
+        (value.xpath('string()') if isinstance(value, etree._Element) else value) in members
+        for value in
+        values
+    )
+
+
+def _register_extensions(module):
+    module.FunctionNamespace(_XPYTH_NS)['member'] = _member
+
+
+etree = _LazyModule('lxml.etree', _register_extensions)
+
+_MISSING = object()
+
+
+def _literal(value):
+    """XPath literal for a Python scalar, or None if there isn't one."""
+    if isinstance(value, bool):
+        return 'true()' if value else 'false()'
+    if isinstance(value, _SCALAR_TYPES[:2]):
+        return _quoted(value)
+    if isinstance(value, float):
+        if value != value:
+            return '(0 div 0)'
+        if value in (float('inf'), float('-inf')):
+            return '(1 div 0)' if value > 0 else '(-1 div 0)'
+        text = repr(value)
+        if 'e' in text:  # XPath numbers have no exponents
+            import decimal
+            text = format(decimal.Decimal(text), 'f')
+        return text
+    if isinstance(value, _SCALAR_TYPES):
+        return repr(value)
+    return None
+
+
+def _quoted(text):
+    """XPath string literal for text, in which (unlike in Python's) backslashes are just backslashes."""
+    if "'" not in text:
+        return "'{}'".format(text)
+    if '"' not in text:
+        return '"{}"'.format(text)
+    return 'concat({})'.format(', "\'", '.join("'{}'".format(part) for part in text.split("'")))
+
+
+def _text(value):
+    return value if isinstance(value, _SCALAR_TYPES[:2]) else type(u'')(value)
+
+
+def _is_lxml(value):
+    # Nothing can be an lxml object unless lxml has been imported
+    return etree.loaded() and isinstance(value, (etree._Element, etree._ElementTree))
+
+
+def _is_document(value):
+    return etree.loaded() and isinstance(value, etree._Element) or _stdlib.is_element(value)
+
+
+def _fingerprint(value):
+    """Hashable stand-in for a captured value, as far as translation is concerned."""
+    if _is_document(value):
+        return _DOM  # only ever checked for being a document
     try:
-        etree.XPath(expression)  # Verify syntax
+        hash(value)
+    except TypeError:
+        if isinstance(value, Iterable):
+            return type(value), tuple(_fingerprint(item) for item in value)
+        return type(value), id(value)
+    return type(value), value
+
+
+def _cache_key(code, options, dependencies, namespace):
+    reads, typed = dependencies
+    return (
+        code,
+        options,
+        tuple(_fingerprint(namespace.get(name, _MISSING)) for name in reads),
+        tuple(type(namespace.get(name, _MISSING)) for name in typed),
+    )
+
+
+def _assigned_names(ast_subtree):
+    """Names of all comprehension variables within the tree."""
+    if ast_subtree.__class__ == AssName:
+        return {ast_subtree.name}
+    return {
+        name
+        for child in
+        ast_subtree.getChildren()
+        if isinstance(child, Node)
+        for name in
+        _assigned_names(child)
+    }
+
+
+def _evaluator(expression, smart_strings=True):
+    """Compiled evaluator for expression, built once per distinct expression."""
+    key = expression, smart_strings
+    evaluator = evaluator_cache.get(key)
+    if evaluator is None:
+        evaluator = etree.XPath(expression, namespaces=_NAMESPACES, smart_strings=smart_strings)
+        evaluator_cache.put(key, evaluator)
+    return evaluator
+
+
+def _translate(g, variables=False, membership=False, hybrid=False):
+    """
+    Translates generator, consulting the translation cache (and any precompiled
+    translations) first. If hybrid is set, conditions on the selected node which
+    XPath can't express are left to the translation's residual, rather than raising.
+    """
+    namespace = _Namespace(g.gi_frame)
+    options = (variables, membership, hybrid)
+    code = g.gi_code
+    instrumented = bool(_instrument.instruments)
+    if instrumented:
+        started = _instrument.clock()
+    translation = translation_cache.lookup(code, options, namespace)
+    if translation is None and _aot.translations:
+        translation = _aot.lookup(code, variables, membership)  # made without a residual, so hybrid or not
+        if translation is not None:
+            translation_cache.store(code, options, _Scope(namespace), translation)
+    if translation is not None:
+        if instrumented:
+            _instrument.translated(code, translation.expression, True)
+        return translation
+    translation, scope = _translate_code(code, namespace, variables, membership, hybrid, started if instrumented else None)
+    translation_cache.store(code, options, scope, translation)
+    if instrumented:
+        _instrument.translated(code, translation.expression, False)
+    return translation
+
+
+def _translate_code(code, namespace, variables, membership, hybrid=False, started=None):
+    """
+    Translates a comprehension's code object, returning the translation and the
+    scope it was made in. Phases are reported to instruments if started is given.
+    """
+    ast = decompile(code)
+    if started is not None:
+        started = _instrument.lap('decompile', started, code)
+    scope = _Scope(namespace, _assigned_names(ast), variables, membership, hybrid)
+    expression = _optimize.optimize(_handle_genexpr(ast, scope))
+    if DEBUG:
+        print(ast)
+        print(expression)
+        print()
+    if started is not None:
+        started = _instrument.lap('translate', started, code)
+    try:
+        _evaluator('.' + expression)  # Verify syntax; query() evaluates the compiled result
     except etree.XPathSyntaxError:
         raise etree.XPathSyntaxError(expression)
-    return expression
+    if started is not None:
+        _instrument.lap('compile', started, code)
+    query_expression, hoisted = _optimize.hoist(expression)
+    residual = None
+    if scope.residual is not None:
+        conditions, target, projection = scope.residual
+        residual = _residual.predicate(conditions, target), projection
+    translation = _Translation(
+        expression,
+        tuple(sorted(scope.bound)),
+        tuple(sorted(scope.members)),
+        hoisted,
+        query_expression,
+        residual,
+    )
+    return translation, scope
+
+
+def xpath(g, variables=False, membership=False):
+    """
+    Returns XPath expression corresponding to generator.
+
+    If variables is set, captured values are referenced as XPath variables
+    named after them (e.g. $user_id) instead of being inlined as literals.
+    If membership is set, tests for inclusion in captured iterables become
+    xpyth:member() calls, which only query() knows how to evaluate.
+    """
+    assert g.gi_frame.f_locals['.0'] == DOM, "Only root-level expressions are supported."
+    return _translate(g, variables, membership).expression
+
+
+class Query(object):
+    """
+    A comprehension over DOM, translated and compiled once, to be evaluated
+    against DOM trees by calling it: q(tree), or q.iter(tree).
+
+    Captured values are bound as XPath variables; those captured when the
+    query was compiled can be overridden by name, e.g. q(tree, user_id=1), as
+    can captured iterables looked up with membership set. Overriding any other
+    name, or a variable with an iterable (or vice versa), raises TypeError.
+    """
+    __slots__ = ('expression', '_translation', '_bindings', '_sets', '_code')
+
+    def __init__(self, g, variables=True, membership=False):
+        assert g.gi_frame.f_locals['.0'] == DOM, "Only root-level expressions are supported."
+        translation = _translate(g, variables, membership)
+        bindings, sets = _bind(translation, _Namespace(g.gi_frame))
+        for name, value in (
+            ('expression', translation.expression),
+            ('_translation', translation),
+            ('_bindings', bindings),
+            ('_sets', sets),
+            ('_code', g.gi_code),
+        ):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("{} objects are immutable".format(self.__class__.__name__))
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.expression)
+
+    def __call__(self, tree, **overrides):
+        """Returns the results of evaluating the query against tree."""
+        bindings, sets = self._bindings, self._sets
+        if overrides:
+            bindings, sets = dict(bindings), dict(sets)
+            for name, value in overrides.items():
+                if name in bindings:
+                    if not isinstance(value, _SCALAR_TYPES):
+                        raise TypeError(
+                            "{!r} was compiled as a variable, so takes a string or number, not {!r}".format(name, value)
+                        )
+                    bindings[name] = value
+                elif name in sets:
+                    if isinstance(value, _SCALAR_TYPES) or not isinstance(value, Iterable):
+                        raise TypeError(
+                            "{!r} was compiled as a membership set, so takes an iterable, not {!r}".format(name, value)
+                        )
+                    sets[name] = frozenset(_text(item) for item in value)
+                else:
+                    raise TypeError("{!r} isn't a variable or membership set of {!r}".format(name, self))
+        if _is_lxml(tree):
+            if _instrument.instruments:
+                return _evaluate(self._translation, bindings, sets, tree, code=self._code)
+            _membership.sets = sets
+            evaluator = _evaluator('.' + self._translation.query_expression)  # this thread's
+            return evaluator(tree, **_hoisted(self._translation, tree, bindings))
+        if _stdlib.is_element(tree):
+            return _evaluate(self._translation, bindings, sets, tree, code=self._code)
+        if _selenium.is_remote(tree):
+            return _selenium.evaluate(self._translation, bindings, sets, tree, self._code)
+        raise NotImplementedError(tree.__class__.__name__)
+
+    def iter(self, tree, **overrides):
+        """Iterates over the results of evaluating the query against tree."""
+        return iter(self(tree, **overrides))
+
+
+def compile(g, variables=True, membership=False):
+    """
+    Translates and compiles a comprehension over DOM into a reusable Query,
+    which can then be evaluated against any number of DOM trees without
+    the comprehension being decompiled again.
+    """
+    return Query(g, variables, membership)
+
+
+def query(g, variables=False, membership=False, limit=None, index=None):
+    """
+    Queries a DOM tree (lxml or xml.etree Element).
+
+    If variables is set, captured values are bound as XPath variables at
+    evaluation time, so that a single compiled expression serves every value.
+    If membership is set, tests for inclusion in captured iterables are
+    answered by a hashed lookup, rather than by one comparison per value.
+    If limit is given, at most that many (leading) matches are returned.
+    If index is a DocumentIndex of the tree, queries it can answer (a tag,
+    optionally tested for equality with or membership of indexed attribute
+    values) are looked up in it rather than evaluated.
+    """
+    return _query(g, variables, membership, index=index, limit=limit)
+
+
+def values(g, variables=False, membership=False, limit=None, index=None):
+    """
+    Queries a DOM tree for attribute or text values (e.g. a.href for a in tree),
+    returning plain strings which, unlike lxml's "smart" strings, don't keep a
+    reference to their parent element (and so to the whole tree).
+    """
+    return _query(g, variables, membership, smart_strings=False, index=index, limit=limit)
+
+
+def query_many(queries, tree, variables=False, membership=False):
+    """
+    Queries a DOM tree (lxml or xml.etree Element) with several comprehensions at
+    once, returning a dict of their results by name. Comprehensions sharing
+    leading location steps (e.g. a container element) have those steps
+    evaluated only once, with the remainder of each evaluated from their result.
+    """
+    return _evaluate_many(_translate_many(queries, variables, membership), tree)
+
+
+def _translate_many(queries, variables, membership):
+    """(name, translation, bindings, sets, code) for each of query_many()'s comprehensions."""
+    translated = []
+    for name, g in queries.items():
+        assert g.gi_frame.f_locals['.0'] == DOM, "Only root-level expressions are supported."
+        translation = _translate(g, variables, membership)
+        bindings, sets = _bind(translation, _Namespace(g.gi_frame))
+        translated.append((name, translation, bindings, sets, g.gi_code))
+    return translated
+
+
+def _evaluate_many(translated, tree):
+    """Evaluates the output of _translate_many() against tree."""
+    if _selenium.is_remote(tree):  # in a single round trip
+        evaluated = _selenium.evaluate_many(
+            [(translation, bindings, sets) for __, translation, bindings, sets, __ in translated],
+            tree,
+            [code for __, __, __, __, code in translated],
+        )
+        return {name: result for (name, __, __, __, __), result in zip(translated, evaluated)}
+    results = {}
+    names_by_expression = collections.defaultdict(list)
+    codes = {}
+    for name, translation, bindings, sets, code in translated:
+        if translation.variables or translation.members or translation.hoisted or _stdlib.is_element(tree):
+            results[name] = _evaluate(translation, bindings, sets, tree, code=code)  # bindings may differ
+        else:
+            names_by_expression[translation.expression].append(name)
+            codes.setdefault(translation.expression, code)
+
+    groups = collections.defaultdict(list)
+    for expression in names_by_expression:
+        steps = _paths.steps(expression)
+        groups[steps[0] if steps[0][0] else expression].append((expression, steps))
+
+    instrumented = bool(_instrument.instruments)
+    for members in groups.values():
+        shared = _common_prefix_length([steps for __, steps in members]) if len(members) > 1 else 0
+        if shared:
+            if instrumented:
+                started = _instrument.clock()
+            prefix_expression = '.' + _paths.join(members[0][1][:shared])
+            prefix = _evaluator(prefix_expression)(tree)
+            if instrumented:
+                _instrument.evaluated(None, prefix_expression, prefix, started)
+        for expression, steps in members:
+            if instrumented:
+                started = _instrument.clock()
+            if not shared:
+                result = _evaluator('.' + expression)(tree)
+            elif steps[shared:]:
+                result = _evaluator('$_xpyth_prefix' + _paths.join(steps[shared:]))(tree, _xpyth_prefix=prefix)
+            else:
+                result = prefix
+            if instrumented:
+                _instrument.evaluated(codes[expression], expression, result, started)
+            for name in names_by_expression[expression]:
+                results[name] = list(result)
+    return results
+
+
+def _common_prefix_length(sequences):
+    length = 0
+    for items in zip(*sequences):
+        if any(item != items[0] for item in items):
+            break
+        length += 1
+    return length
+
+
+def first(g, variables=False, membership=False):
+    """Returns the first match of a query against a DOM tree, or None if nothing matches."""
+    results = _query(g, variables, membership, limit=1)
+    return results[0] if results else None
+
+
+def exists(g, variables=False, membership=False):
+    """Returns whether a query against a DOM tree matches anything."""
+    return bool(_query(g, variables, membership, limit=1))
+
 
+def _bind(translation, namespace):
+    """Variable bindings and xpyth:member() sets for translation, taken from namespace."""
+    bindings = {name: namespace[name] for name in translation.variables}
+    sets = {
+        name: frozenset(_text(value) for value in namespace[name])
+        for name in translation.members
+    }
+    return bindings, sets
 
-def query(g):
-    """Queries a DOM tree (lxml Element)."""
+
+def _evaluate(translation, bindings, sets, dom, smart_strings=True, code=None):
+    """
+    Evaluates translation against an lxml or xml.etree element.
+    code is that of the comprehension translated, for instrumentation.
+    """
+    instrumented = bool(_instrument.instruments)
+    if instrumented:
+        started = _instrument.clock()
+    if _stdlib.is_element(dom):
+        results = _stdlib.evaluator('.' + translation.expression)(dom, bindings, sets)
+    else:
+        _membership.sets = sets
+        evaluator = _evaluator('.' + translation.query_expression, smart_strings)
+        results = evaluator(dom, **_hoisted(translation, dom, bindings))
+    if instrumented:
+        _instrument.evaluated(code, translation.expression, results, started)
+    return results
+
+
+def _hoisted(translation, dom, bindings):
+    """bindings, plus the values of translation's hoisted tests, evaluated against (lxml) dom."""
+    if not translation.hoisted:
+        return bindings
+    bindings = dict(bindings)
+    for name, path in translation.hoisted:
+        bindings[name] = _evaluator(path)(dom, **bindings)
+    return bindings
+
+
+def _document(iterator):
+    """The element whose children iterator iterates over (i.e. tree, in `a for a in tree`)."""
     try:
-        dom = next(g.gi_frame.f_locals['.0']).getparent()  # lxml  # TODO: change for selenium etc.
+        __, (element,), __ = iterator.__reduce__()  # plain sequence iterator, as for xml.etree
+        return element
+    except (TypeError, ValueError):
+        return next(iterator).getparent()  # lxml
+
+
+def _query(g, variables, membership, smart_strings=True, index=None, limit=None):
+    """
+    Evaluates generator against its DOM tree, returning at most limit results,
+    if given. Where it can be, an lxml tree is only searched until they're found.
+    """
+    try:
+        dom = _document(g.gi_frame.f_locals['.0'])  # TODO: change for selenium etc.
     except StopIteration:
         return []  # copying what lxml does
-    
-    # Magic to convert our generator into a DOM-generator (http://pydev.blogspot.co.uk/2014/02/changing-locals-of-frame-frameflocals.html)
-    g.gi_frame.f_locals['.0'] = DOM
-    ctypes.pythonapi.PyFrame_LocalsToFast(ctypes.py_object(g.gi_frame), ctypes.c_int(0))
-    
-    expression = '.' + xpath(g)
 
-    method_names = (
-        'xpath',  # lxml ElementTree
-        'findall',  # xml ElementTree
-        'find_elements_by_xpath',  # selenium WebDriver/WebElement
-    )
-    for method_name in method_names:
-        try:
-            xpath_method = getattr(dom, method_name)
-            break
-        except AttributeError:
-            pass
-    else:
+    if _is_lxml(dom) or _stdlib.is_element(dom):
+        translation = _translate(g, variables, membership, hybrid=True)
+        namespace = _Namespace(g.gi_frame)
+        bindings, sets = _bind(translation, namespace)
+        results = None
+        if index is not None:
+            results = index.evaluate(translation, bindings, sets, dom, smart_strings, g.gi_code)
+        if results is None and limit is not None and _is_lxml(dom):
+            results = _leading.evaluate(translation, bindings, sets, dom, namespace, limit, smart_strings, g.gi_code)
+            if results is not None:
+                return results
+        if results is None:
+            results = _evaluate(translation, bindings, sets, dom, smart_strings, g.gi_code)
+        if translation.residual is not None:
+            results = _residual.apply(translation.residual, results, namespace, smart_strings)
+        return _truncated(results, limit)
+
+    if _selenium.is_remote(dom):
+        translation = _translate(g, variables, membership)
+        bindings, sets = _bind(translation, _Namespace(g.gi_frame))
+        return _truncated(_selenium.evaluate(translation, bindings, sets, dom, g.gi_code), limit)
+
+    try:
+        xpath_method = dom.xpath
+    except AttributeError:
         raise NotImplementedError(dom.__class__.__name__)
+    return _truncated(xpath_method('.' + _translate(g).expression), limit)
+
 
-    return xpath_method(expression)
+def _truncated(results, limit):
+    return results if limit is None else results[:limit]
 
 
 _ATTR_REPLACEMENTS = {
@@ -123,6 +785,22 @@ _COMPARE_OP_OPPOSITES = {
 _COMPARE_OP_OPPOSITES.update({v: k for k, v in _COMPARE_OP_OPPOSITES.items()})
 _COMPARE_OP_OPPOSITES['='] = '!='
 
+_REGEX_ANCHORS = {
+    'search': '{}',
+    'match': r'\A(?:{})',
+    'fullmatch': r'\A(?:{})\Z',
+}
+
+_REGEX_FLAGS = (
+    (re.IGNORECASE, 'i'),
+    (re.MULTILINE, 'm'),
+    (re.DOTALL, 's'),
+    (re.VERBOSE, 'x'),
+    (getattr(re, 'ASCII', 0), 'a'),
+)
+
+_INLINE_FLAGS = re.compile(r'^\(\?([aiLmsux]+)\)')
+
 _GENEXPRFOR_GETATTR_SEP_OVERRIDES = {
     'ancestors': '/ancestor::',
     'ancestors_or_self': '/ancestor-or-self::',
@@ -146,7 +824,7 @@ def _root_level(genexpr, frame_locals):
     if genexprfor_src.__class__ == Name:
         name = genexprfor_src.name
         known_dom = name in ('DOM', '.0')
-        return known_dom or isinstance(frame_locals.get(name), etree._Element)
+        return known_dom or _is_document(frame_locals.get(name))
 
 
 def _get_highest_src(if_, ranked_srcs):
@@ -173,37 +851,32 @@ def _get_highest_src(if_, ranked_srcs):
     return []
 
 
-def _subtree_handler_factory():
-    SUBTREE_HANDLERS = {}
-    
-    def _subtree_handler(*ntypes, **kwargs):
-        supply_ast = kwargs.get('supply_ast', False)
-        def decorator(f):
-            @functools.wraps(f)
-            def wrapper(ast_subtree, frame_locals, relative=False):
-                children = ast_subtree.getChildren()
-                result = f(ast_subtree if supply_ast else children, frame_locals, relative)
-                if DEBUG:
-                    print(f.__name__)
-                    print(result)
-                    print()
-                return result
-            for ntype in ntypes:
-                SUBTREE_HANDLERS[ntype] = wrapper
-            return wrapper
-        return decorator
-
-    def _dispatch(subtree):
-        """Choose appropriate subtree handler for subtree type"""
-        ntype = subtree.__class__
-        try:
-            return functools.partial(SUBTREE_HANDLERS[ntype], subtree)
-        except KeyError:
-            raise NotImplementedError(ntype.__name__)
+_SUBTREE_HANDLERS = {}
 
-    return _subtree_handler, _dispatch
 
-_subtree_handler, _dispatch = _subtree_handler_factory()
+def _subtree_handler(*ntypes, **kwargs):
+    supply_ast = kwargs.get('supply_ast', False)
+    def decorator(f):
+        if supply_ast:
+            handler = f
+        else:
+            def handler(ast_subtree, frame_locals, relative=False):
+                return f(ast_subtree.getChildren(), frame_locals, relative)
+            handler.__name__ = f.__name__
+            handler.__doc__ = f.__doc__
+        for ntype in ntypes:
+            _SUBTREE_HANDLERS[ntype] = handler
+        return handler
+    return decorator
+
+
+def _dispatch(subtree, frame_locals, relative=False):
+    """Translate subtree with the appropriate subtree handler for its type"""
+    try:
+        handler = _SUBTREE_HANDLERS[subtree.__class__]
+    except KeyError:
+        raise NotImplementedError(subtree.__class__.__name__)
+    return handler(subtree, frame_locals, relative)
 
 
 @_subtree_handler(GenExpr)
@@ -219,6 +892,8 @@ def _handle_genexprinner(children, frame_locals, relative):
     name = children[0]
     fors = children[1:]
     rel = '.' if relative else ''
+    hybrid, frame_locals.hybrid = frame_locals.hybrid, False  # only the outermost comprehension's conditions
+    residual = []
 
     # Rearrange tree if returning booleans, not nodes (all, any)
     return_type = name.__class__
@@ -241,7 +916,7 @@ def _handle_genexprinner(children, frame_locals, relative):
             ),
             ops
         )
-        return rel + _dispatch(new_tree)(frame_locals)  # TODO: replace with Compare, since we know this
+        return rel + _dispatch(new_tree, frame_locals)  # TODO: replace with Compare, since we know this
 
     # Rearrange ifs
     for_srcs = {for_.assign.name: for_ for for_ in fors if for_.__class__}
@@ -281,17 +956,59 @@ def _handle_genexprinner(children, frame_locals, relative):
                 except ValueError:  # we constructed this conditional artificially
                     pass
 
+        if hybrid and for_ is fors[-1]:
+            residual = _split_residual(for_, frame_locals, {other.assign.name for other in fors[:-1]})
+
         # conjoin any loose conditionals
         if len(for_.ifs) > 1:
             for_.ifs = [reduce(lambda x, y: And([x, y]), for_.ifs)]
 
     assert all(for_.__class__ == GenExprFor for for_ in fors)  # TODO: remove
+    target = fors[-1].assign.name
     fors = ''.join([_handle_genexprfor(for_, frame_locals) for for_ in fors])
-    if return_type in (Getattr, Sub):
-        return '{}/{}'.format(fors, _dispatch(name)(frame_locals))
+    projection = _dispatch(name, frame_locals) if return_type in (Getattr, Sub) else None
+    if residual:
+        # Select the elements, for Python to filter and then project
+        if _referenced_names(name) & (frame_locals.targets - {target}):
+            raise NotImplementedError(name)
+        frame_locals.residual = residual, target, projection
+        return fors
+    if projection is not None:
+        return '{}/{}'.format(fors, projection)
     return fors
 
 
+def _referenced_names(ast_subtree):
+    """Names of all variables read within the tree."""
+    if ast_subtree.__class__ == Name:
+        return {ast_subtree.name}
+    return {
+        name
+        for child in
+        ast_subtree.getChildren()
+        if isinstance(child, Node)
+        for name in
+        _referenced_names(child)
+    }
+
+
+def _split_residual(for_, frame_locals, others):
+    """
+    Removes for_'s conditions which XPath can't express, returning them, so long as
+    they don't concern the comprehension's other variables (in others).
+    """
+    residual = []
+    for if_ in for_.ifs[:]:
+        try:
+            _dispatch(if_, frame_locals)
+        except NotImplementedError:
+            if _referenced_names(if_) & others:
+                raise
+            for_.ifs.remove(if_)
+            residual.append(if_)
+    return residual
+
+
 @_subtree_handler(Name, AssName, supply_ast=True)
 def _handle_name(ast_subtree, frame_locals, relative=False):
     name = ast_subtree.name
@@ -311,9 +1028,9 @@ def _handle_genexprfor(children, frame_locals, relative):
         sep = _GENEXPRFOR_GETATTR_SEP_OVERRIDES.get(src.attrname, '//')
     if not conds:
         # TODO: determine type of name
-        return '{}{}'.format(sep, _dispatch(name)(frame_locals))  # slashes are contingent on src
+        return '{}{}'.format(sep, _dispatch(name, frame_locals))  # slashes are contingent on src
     # TODO: determine type of conds
-    return '{}{}[{}]'.format(sep, _dispatch(name)(frame_locals), _dispatch(conds[0])(frame_locals))  # 0?
+    return '{}{}[{}]'.format(sep, _dispatch(name, frame_locals), _dispatch(conds[0], frame_locals))  # 0?
 
 
 @_subtree_handler(Getattr)
@@ -329,7 +1046,7 @@ def _handle_getattr(children, frame_locals, relative):
 def _handle_genexprif(children, frame_locals, relative):
     rel = '.' if relative else ''
     if len(children) == 1:
-        return _dispatch(children[0])(frame_locals)  # TODO: see if child type is consistent
+        return _dispatch(children[0], frame_locals)  # TODO: see if child type is consistent
     raise NotImplementedError(children)
 
 
@@ -339,10 +1056,16 @@ def _handle_compare(children, frame_locals, relative):
 
     if len(children) == 3:
         n1, op, n2 = children
+        if n2.__class__ == Name and op in ('in', 'not in'):
+            # Special case - hashed lookup into an iterable from outer scope, bound at evaluation time
+            members = frame_locals.hashed(n2.name)
+            if members is not None:
+                lookup = "xpyth:member({}, '{}')".format(_handle_operand(n1, frame_locals, rel), members)
+                return lookup if op == 'in' else 'not({})'.format(lookup)
         if n2.__class__ == Name:
             # Special case - drag in from outer scope if we're checking inclusion of value in iterable
             local = frame_locals.get(n2.name)
-            if isinstance(local, collections.Iterable) and op == 'in':
+            if isinstance(local, Iterable) and op == 'in':
                 n2 = Const(local)
         if op == 'in' and n2.__class__ == Const and not isinstance(n2.value, str):
             # Special case - checking whether value is in iterable
@@ -350,49 +1073,108 @@ def _handle_compare(children, frame_locals, relative):
             return rel + _handle_or(Or(comparisons), frame_locals)
         op = _COMPARE_OP_REPLACEMENTS.get(op, op)
         format_str = _COMPARE_OP_FORMAT_OVERRIDES.get(op, '{}{}{}')
-        return format_str.format(rel + _dispatch(n1)(frame_locals), op, rel + _dispatch(n2)(frame_locals))
+        return format_str.format(_handle_operand(n1, frame_locals, rel), op, _handle_operand(n2, frame_locals, rel))
     raise NotImplementedError(children)
 
 
+def _handle_operand(operand, frame_locals, rel):
+    """Comparison operand, substituting in values captured from the enclosing scope."""
+    if operand.__class__ == Name:
+        captured = frame_locals.capture(operand.name)
+        if captured is not None:
+            return captured
+    return rel + _dispatch(operand, frame_locals)
+
+
 @_subtree_handler(Const, supply_ast=True)
 def _handle_const(ast_subtree, frame_locals, relative=False):
-    return repr(ast_subtree.value)
+    literal = _literal(ast_subtree.value)
+    return repr(ast_subtree.value) if literal is None else literal
 
 
 @_subtree_handler(And)
 def _handle_and(children, frame_locals, relative):
     rel = '.' if relative else ''
-    return ' and '.join(rel + _dispatch(child)(frame_locals) for child in children)
+    terms = []
+    for child in children:
+        term = rel + _dispatch(child, frame_locals)
+        test = child.test if child.__class__ == GenExprIf else child
+        terms.append('({})'.format(term) if test.__class__ == Or else term)
+    return ' and '.join(sorted(terms, key=_optimize.cost))  # cheapest first, as and short-circuits
 
 
 @_subtree_handler(Or)
 def _handle_or(children, frame_locals, relative):
     rel = '.' if relative else ''
-    return ' or '.join(rel + _dispatch(child)(frame_locals) for child in children)
+    return ' or '.join(rel + _dispatch(child, frame_locals) for child in children)
 
 
 @_subtree_handler(Not)
 def _handle_not(children, frame_locals, relative):
     child, = children
     rel = '.' if relative else ''
-    return 'not({})'.format(rel + _dispatch(child)(frame_locals))
+    return 'not({})'.format(rel + _dispatch(child, frame_locals))
 
 
 @_subtree_handler(Sub)
 def _handle_sub(children, frame_locals, relative):
-    return '-'.join(_dispatch(child)(frame_locals) for child in children)
+    return '-'.join(_dispatch(child, frame_locals) for child in children)
+
+
+def _regex_argument(node, frame_locals):
+    """Value of a pattern or flags argument to a re function: a constant, a captured name, or e.g. re.I."""
+    if node.__class__ == Const:
+        return node.value
+    if node.__class__ == Name:
+        return frame_locals.get(node.name)
+    if node.__class__ == Getattr and node.expr.__class__ == Name and frame_locals.get(node.expr.name) is re:
+        return getattr(re, node.attrname)
+    raise NotImplementedError(node)
+
+
+def _regex_test(function, args, frame_locals, rel):
+    """EXSLT re:test() equivalent of re.search/match/fullmatch(pattern, string[, flags])."""
+    if len(args) not in (2, 3):
+        raise NotImplementedError(args)
+    pattern = _regex_argument(args[0], frame_locals)
+    flags = _regex_argument(args[2], frame_locals) if len(args) == 3 else 0
+    if hasattr(pattern, 'pattern'):  # compiled
+        pattern, flags = pattern.pattern, flags | pattern.flags
+    if not isinstance(pattern, _SCALAR_TYPES[:2]) or not isinstance(flags, int):
+        raise NotImplementedError(args)
+    leading = _INLINE_FLAGS.match(pattern)  # must stay at the very start
+    inline = leading.group(1) if leading else ''
+    pattern = pattern[leading.end():] if leading else pattern
+    flags &= ~getattr(re, 'UNICODE', 0)  # implied for str patterns
+    for flag, letter in _REGEX_FLAGS:
+        if flags & flag:
+            flags &= ~flag
+            inline += letter
+    if flags:
+        raise NotImplementedError(flags)
+    # lxml evaluates re:test() with Python's re, so inline flags and \A and \Z carry over
+    pattern = ('(?{})'.format(inline) if inline else '') + _REGEX_ANCHORS[function].format(pattern)
+    return 're:test({}, {})'.format(_handle_operand(args[1], frame_locals, rel), _quoted(pattern))
 
 
 @_subtree_handler(CallFunc)
 def _handle_callfunc(children, frame_locals, relative):
     rel = '.' if relative else ''
-    if isinstance(children[0], Name):
+    function = children[0]
+    if (
+        function.__class__ == Getattr
+        and function.attrname in _REGEX_ANCHORS
+        and function.expr.__class__ == Name
+        and frame_locals.get(function.expr.name) is re
+    ):
+        return _regex_test(function.attrname, children[1:-2], frame_locals, rel)
+    if isinstance(children[0], Name) and children[1].__class__ == GenExpr:
         func_name = children[0].name
         is_relative = lambda: not _root_level(children[1], frame_locals)
         if func_name == 'any':
-            return rel + _dispatch(children[1])(frame_locals, is_relative())
+            return rel + _dispatch(children[1], frame_locals, is_relative())
         if func_name == 'len':
-            return 'count({})'.format(rel + _dispatch(children[1])(frame_locals, is_relative()))
+            return 'count({})'.format(rel + _dispatch(children[1], frame_locals, is_relative()))
         elif func_name == 'all':
             # Need to change (\all x. P) to (\not \exists x. \not P)
             genexprinner = children[1].getChildren()[0]
@@ -414,3 +1196,36 @@ def _handle_callfunc(children, frame_locals, relative):
             )
             return rel + _handle_not(new_tree, frame_locals, is_relative())
     raise NotImplementedError(children)
+
+
+from xpyth import _aot, _selenium, _stdlib
+from xpyth import _leading, _residual
+from xpyth._aot import load_precompiled
+from xpyth._batch import query_batch
+from xpyth._files import query_file
+from xpyth._index import DocumentIndex
+from xpyth._parallel import parallel_query
+from xpyth._stream import stream_query
+from xpyth._table import query_table
+
+if os.environ.get(_aot.ENVIRONMENT_VARIABLE):
+    load_precompiled(os.environ[_aot.ENVIRONMENT_VARIABLE])
+
+_LAZY_ATTRIBUTES = {}  # name -> module defining it, imported when the name is first looked up
+if sys.version_info >= (3, 5):  # async syntax
+    _LAZY_ATTRIBUTES.update(dict.fromkeys(('AsyncPool', 'aquery', 'aquery_many'), 'xpyth._async'))  # asyncio
+    __all__ += ['AsyncPool', 'aquery', 'aquery_many']
+
+
+def __getattr__(name):  # Python 3.7+
+    try:
+        module = _LAZY_ATTRIBUTES[name]
+    except KeyError:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = globals()[name] = getattr(importlib.import_module(module), name)
+    return value
+
+
+if sys.version_info < (3, 7):  # no module __getattr__, so import them now
+    for _name in _LAZY_ATTRIBUTES:
+        __getattr__(_name)
@@ -0,0 +1,64 @@
+"""
+Translations made ahead of time, by xpyth-compile (see xpyth._precompile).
+
+Loading a table of them, with load_precompiled() or by pointing the
+XPYTH_PRECOMPILED environment variable at it, means the comprehensions it
+covers are never decompiled at runtime. Translations are keyed by Python
+version and by a digest of each comprehension's bytecode, and are only used
+for calls made with the options (variables and membership) they were made with.
+"""
+
+import sys
+import types
+
+from xpyth import _Translation
+
+
+ENVIRONMENT_VARIABLE = 'XPYTH_PRECOMPILED'
+
+translations = {}  # (digest, variables, membership) -> _Translation, for this Python version
+
+
+def version():
+    """Key of this Python's translations in a table, as bytecode differs between versions."""
+    import platform
+    return '{}-{}.{}'.format(platform.python_implementation().lower(), *sys.version_info[:2])
+
+
+def _const(value):
+    if isinstance(value, types.CodeType):
+        return digest(value)
+    if isinstance(value, frozenset):  # iteration order varies with string hashing
+        return 'frozenset({})'.format(sorted(_const(item) for item in value))
+    if isinstance(value, tuple):
+        return '({})'.format(', '.join(_const(item) for item in value))
+    return repr(value)
+
+
+def digest(code):
+    """Digest of a code object's bytecode, names and constants, but not of where it came from."""
+    import hashlib
+    parts = [
+        repr(code.co_code),
+        repr((code.co_names, code.co_varnames, code.co_freevars, code.co_cellvars)),
+        _const(code.co_consts),
+    ]
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def lookup(code, variables=False, membership=False):
+    """Precompiled translation of a comprehension, made with the given options, if there is one."""
+    return translations.get((digest(code), bool(variables), bool(membership)))
+
+
+def load_precompiled(path):
+    """Loads this Python version's translations from a table written by xpyth-compile."""
+    import json
+    with open(path) as f:
+        table = json.load(f)
+    for key, entry in table.get(version(), {}).items():
+        expression, hoisted, query_expression = entry[:3]
+        variables, membership = entry[3] if len(entry) > 3 else (False, False)  # tables predating options
+        hoisted = tuple(tuple(pair) for pair in hoisted)
+        translations[key, variables, membership] = _Translation(expression, (), (), hoisted, query_expression, None)
+    return len(translations)
@@ -0,0 +1,116 @@
+"""
+Querying from asyncio code, without blocking the event loop.
+
+Comprehensions are translated on the event loop, which is cheap once their
+translations are cached; parsing and evaluation, which are not, happen in an
+executor. libxml2 releases the GIL while it parses and evaluates, so a thread
+pool keeps every core busy.
+"""
+
+import asyncio
+import concurrent.futures
+import os
+import weakref
+
+from xpyth import DOM, etree, _bind, _evaluate, _evaluate_many, _is_lxml, _Namespace, _translate, _translate_many
+
+
+def _cpus():
+    return os.cpu_count() or 1
+
+
+def _parse(source, html):
+    """source, parsing it first if it's markup rather than an lxml tree."""
+    if _is_lxml(source):
+        return source
+    return (etree.HTML if html else etree.XML)(source)
+
+
+def _query_source(translation, bindings, sets, source, html, smart_strings, code):
+    return _evaluate(translation, bindings, sets, _parse(source, html), smart_strings=smart_strings, code=code)
+
+
+def _query_many_source(translated, source, html):
+    return _evaluate_many(translated, _parse(source, html))
+
+
+class AsyncPool(object):
+    """
+    Runs queries in an executor on behalf of coroutines, with at most max_pending
+    of them (by default, two per CPU) submitted at once; callers beyond that wait
+    their turn on the event loop, rather than queueing up their documents in the
+    executor.
+
+    executor defaults to a thread pool with a thread per CPU. Process pools work
+    too, but as lxml elements can't be sent between processes, only values (of
+    attribute or text projections) can be returned from them.
+    """
+
+    def __init__(self, executor=None, max_pending=None):
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(_cpus())
+        self.executor = executor
+        self.max_pending = max_pending or 2 * _cpus()
+        self._remote = isinstance(executor, concurrent.futures.ProcessPoolExecutor)
+        self._semaphores = weakref.WeakKeyDictionary()  # event loop -> its semaphore
+
+    def _semaphore(self, loop):
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_pending)
+        return semaphore
+
+    async def _run(self, function, *args):
+        loop = asyncio.get_event_loop()
+        async with self._semaphore(loop):
+            return await loop.run_in_executor(self.executor, function, *args)
+
+    async def query(self, g, source, html=True, variables=False, membership=False, values=False):
+        """
+        Evaluates a comprehension over DOM against source: an lxml tree, or HTML
+        (or, if html is unset, XML) markup to be parsed in the executor. If values
+        is set, plain strings are returned, as by xpyth.values().
+        """
+        assert g.gi_frame.f_locals['.0'] == DOM, "Only root-level expressions are supported."
+        translation = _translate(g, variables, membership)
+        bindings, sets = _bind(translation, _Namespace(g.gi_frame))
+        code = None if self._remote else g.gi_code  # code objects can't be pickled
+        smart_strings = not (values or self._remote)
+        return await self._run(_query_source, translation, bindings, sets, source, html, smart_strings, code)
+
+    async def query_many(self, queries, source, html=True, variables=False, membership=False):
+        """As xpyth.query_many(), against source as for query()."""
+        translated = _translate_many(queries, variables, membership)
+        if self._remote:
+            translated = [(name, translation, bindings, sets, None) for name, translation, bindings, sets, __ in translated]
+        return await self._run(_query_many_source, translated, source, html)
+
+    def close(self, wait=True):
+        """Shuts down the executor."""
+        self.executor.shutdown(wait)
+
+
+_default_pool = None
+
+
+def _pool(pool):
+    global _default_pool
+    if pool is not None:
+        return pool
+    if _default_pool is None:
+        _default_pool = AsyncPool()
+    return _default_pool
+
+
+async def aquery(g, source, html=True, variables=False, membership=False, values=False, pool=None):
+    """
+    Coroutine version of query(), taking a comprehension over DOM and the source
+    to evaluate it against: an lxml tree, or markup. Parsing and evaluation run
+    in pool, an AsyncPool, which defaults to one with a thread per CPU.
+    """
+    return await _pool(pool).query(g, source, html, variables, membership, values)
+
+
+async def aquery_many(queries, source, html=True, variables=False, membership=False, pool=None):
+    """Coroutine version of query_many(), parsing and evaluating as aquery() does."""
+    return await _pool(pool).query_many(queries, source, html, variables, membership)
@@ -0,0 +1,79 @@
+"""
+Evaluation of a comprehension against many documents, across processes.
+
+The comprehension is translated once, in the calling process; each worker
+process is handed the translation when it starts, and from then on only the
+documents' paths (or markup) are sent to it, and only their results, as plain
+strings or serialized elements, are sent back.
+"""
+
+from xpyth import DOM, etree, _bind, _evaluate, _is_lxml, _Namespace, _translate
+from xpyth._files import parser, root
+
+
+_job = None  # (translation, bindings, sets, html, parser options, markup), in a worker process
+
+
+def _initialize(*job):
+    global _job
+    _job = job
+
+
+def _portable(result):
+    """result, or, if it's an element, its markup, as elements can't be sent between processes."""
+    if _is_lxml(result):
+        return etree.tostring(result, encoding=type(u''), with_tail=False)
+    return result
+
+
+def _query_source(source):
+    translation, bindings, sets, html, options, markup = _job
+    if markup:
+        element = etree.fromstring(source, parser(html, **options))
+    else:
+        element = root(source, html, **options)  # the root element either way, as for query()
+    return [_portable(result) for result in _evaluate(translation, bindings, sets, element, smart_strings=False)]
+
+
+def _query_numbered(numbered):
+    i, source = numbered
+    return i, _query_source(source)
+
+
+def query_batch(
+    g, sources, workers=None, chunksize=16, ordered=True, html=True, parser_options=None, markup=False,
+    variables=False, membership=False,
+):
+    """
+    Evaluates a comprehension over DOM against many documents in a pool of
+    worker processes (by default, one per CPU), yielding each document's results
+    as a list of plain strings, or of the markup of selected elements.
+
+    sources are paths of HTML (or, if html is unset, XML) files, or, if markup is
+    set, the documents' markup; parser_options are as for query_file(). Results
+    are yielded in the order of sources, or, if ordered is unset, as soon as
+    they're ready, as (index of source, results) pairs. Documents are sent to
+    workers chunksize at a time; the more documents there are, and the smaller
+    they are, the larger it should be.
+    """
+    assert g.gi_frame.f_locals['.0'] == DOM, "Only root-level expressions are supported."
+    translation = _translate(g, variables, membership)
+    bindings, sets = _bind(translation, _Namespace(g.gi_frame))
+    job = translation, bindings, sets, html, parser_options or {}, markup
+    return _results(job, sources, workers, chunksize, ordered)
+
+
+def _results(job, sources, workers, chunksize, ordered):
+    import multiprocessing  # only once there's a batch to run
+    pool = multiprocessing.Pool(workers or multiprocessing.cpu_count(), initializer=_initialize, initargs=job)
+    try:
+        if ordered:
+            results = pool.imap(_query_source, sources, chunksize)
+        else:
+            results = pool.imap_unordered(_query_numbered, enumerate(sources), chunksize)
+        for result in results:
+            yield result
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
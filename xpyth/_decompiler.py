@@ -0,0 +1,462 @@
+"""
+Rebuilds the syntax tree of a generator expression from its bytecode.
+
+Only what comprehensions over DOM are made of is understood: loops,
+conditions made of comparisons, attribute lookups, calls and boolean
+operators, and nested generator expressions. Anything else raises
+NotImplementedError.
+"""
+
+import collections
+import dis
+import sys
+
+from xpyth._nodes import (
+    And, AssName, CallFunc, Compare, Const, GenExpr, GenExprFor, GenExprIf, GenExprInner,
+    Getattr, List, Name, Not, Or, Sub, Subscript, Tuple,
+)
+
+
+_Instruction = collections.namedtuple('_Instruction', 'opname arg argval argrepr offset')
+
+_PY2 = sys.version_info < (3,)
+_NULL_GLOBALS = sys.version_info >= (3, 11)  # LOAD_GLOBAL's low bit pushes NULL
+_NULL_ATTRS = sys.version_info >= (3, 12)  # LOAD_ATTR's low bit loads a method
+_FLAGGED_FUNCTIONS = sys.version_info >= (3, 6)  # MAKE_FUNCTION's arg flags its extra arguments
+
+_SKIPPED = frozenset((
+    'CACHE', 'COPY_FREE_VARS', 'EXTENDED_ARG', 'GEN_START', 'MAKE_CELL', 'NOP', 'NOT_TAKEN',
+    'PRECALL', 'RESUME', 'RETURN_GENERATOR', 'SETUP_LOOP', 'TO_BOOL',
+))
+
+_RENAMED = {
+    'POP_JUMP_FORWARD_IF_FALSE': 'POP_JUMP_IF_FALSE',
+    'POP_JUMP_BACKWARD_IF_FALSE': 'POP_JUMP_IF_FALSE',
+    'POP_JUMP_FORWARD_IF_TRUE': 'POP_JUMP_IF_TRUE',
+    'POP_JUMP_BACKWARD_IF_TRUE': 'POP_JUMP_IF_TRUE',
+    'JUMP_ABSOLUTE': 'JUMP',
+    'JUMP_FORWARD': 'JUMP',
+    'JUMP_BACKWARD': 'JUMP',
+    'JUMP_BACKWARD_NO_INTERRUPT': 'JUMP',
+    'LOAD_FAST_CHECK': 'LOAD_FAST',
+    'LOAD_FAST_BORROW': 'LOAD_FAST',
+    'LOAD_CLASSDEREF': 'LOAD_DEREF',
+    'CALL_METHOD': 'CALL',
+}
+
+_CONDITIONAL_JUMPS = {'POP_JUMP_IF_FALSE': 'POP_JUMP_IF_TRUE', 'POP_JUMP_IF_TRUE': 'POP_JUMP_IF_FALSE'}
+_SHORT_CIRCUITS = {'JUMP_IF_FALSE_OR_POP': And, 'JUMP_IF_TRUE_OR_POP': Or}  # and/or computing a value
+
+
+class _Null(object):
+    """Placeholder for the NULL some interpreters push alongside callables."""
+
+
+_NULL = _Null()
+
+_MAX_CACHED = 256
+_cached_instructions = {}  # code object -> its instructions, which (unlike syntax trees) are never modified
+
+
+class _Function(object):
+    def __init__(self, code):
+        self.code = code
+
+
+def _raw_instructions(code):
+    if not _PY2:
+        for instruction in dis.get_instructions(code):
+            yield instruction
+        return
+
+    bytecode = code.co_code
+    free = code.co_cellvars + code.co_freevars
+    extended = 0
+    i = 0
+    while i < len(bytecode):
+        offset = i
+        opcode = ord(bytecode[i])
+        i += 1
+        arg = argval = None
+        if opcode >= dis.HAVE_ARGUMENT:
+            arg = ord(bytecode[i]) + ord(bytecode[i + 1]) * 256 + extended
+            i += 2
+            extended = 0
+            if opcode == dis.EXTENDED_ARG:
+                extended = arg * 65536
+                continue
+            argval = arg
+            if opcode in dis.hasconst:
+                argval = code.co_consts[arg]
+            elif opcode in dis.hasname:
+                argval = code.co_names[arg]
+            elif opcode in dis.haslocal:
+                argval = code.co_varnames[arg]
+            elif opcode in dis.hasfree:
+                argval = free[arg]
+            elif opcode in dis.hasjrel:
+                argval = i + arg
+            elif opcode in dis.hascompare:
+                argval = dis.cmp_op[arg]
+        yield _Instruction(dis.opname[opcode], arg, argval, '', offset)
+
+
+def _instructions(code):
+    """
+    The instructions of code, with no-ops dropped, opcode names unified across
+    interpreter versions and jumps to unconditional jumps short-circuited.
+    """
+    try:
+        return _cached_instructions[code]
+    except KeyError:
+        pass
+
+    instructions = []
+    pending = []  # offsets of dropped instructions, which jumps to resolve to the next one kept
+    moved = {}
+    previous = None
+    for raw in _raw_instructions(code):
+        opname = _RENAMED.get(raw.opname, raw.opname)
+        if opname in _SKIPPED or opname == 'POP_TOP' and previous == 'RETURN_GENERATOR':
+            pending.append(raw.offset)
+            previous = opname
+            continue
+        for offset in pending:
+            moved[offset] = raw.offset
+        pending = []
+        previous = opname
+        instructions.append(_Instruction(opname, raw.arg, raw.argval, raw.argrepr, raw.offset))
+
+    by_offset = {instruction.offset: instruction for instruction in instructions}
+
+    def destination(offset):
+        offset = moved.get(offset, offset)
+        seen = set()
+        while offset in by_offset and by_offset[offset].opname == 'JUMP' and offset not in seen:
+            seen.add(offset)
+            offset = moved.get(by_offset[offset].argval, by_offset[offset].argval)
+        return offset
+
+    resolved = []
+    skip = False
+    for i, instruction in enumerate(instructions):
+        if skip:
+            skip = False
+            continue
+        if instruction.opname in _CONDITIONAL_JUMPS:
+            target = destination(instruction.argval)
+            following = instructions[i + 1:i + 3]
+            if (
+                len(following) == 2
+                and following[0].opname == 'JUMP'
+                and target == following[1].offset
+            ):
+                # Jump over an unconditional jump: the same as jumping there on the opposite condition
+                instruction = instruction._replace(
+                    opname=_CONDITIONAL_JUMPS[instruction.opname],
+                    argval=destination(following[0].argval),
+                )
+                skip = True
+            else:
+                instruction = instruction._replace(argval=target)
+        resolved.append(instruction)
+
+    if len(_cached_instructions) >= _MAX_CACHED:
+        _cached_instructions.clear()
+    _cached_instructions[code] = resolved = tuple(resolved)
+    return resolved
+
+
+class _Test(object):
+    """A conditional jump, and the offset at which the code computing its condition starts."""
+
+    __slots__ = ('start', 'expr', 'if_true', 'target')
+
+    def __init__(self, start, expr, if_true, target):
+        self.start = start
+        self.expr = expr
+        self.if_true = if_true
+        self.target = target
+
+
+def _combine(node_type, nodes):
+    flat = []
+    for node in nodes:
+        flat.extend(node.nodes if node.__class__ is node_type else [node])
+    return node_type(flat)
+
+
+def _condition(tests, end, target, on_true):
+    """
+    Boolean expression evaluated by tests, which jump to target when it is
+    on_true, and otherwise fall through to end.
+    """
+    if len(tests) == 1:
+        test, = tests
+        if test.target != target:
+            raise NotImplementedError('jump to {}'.format(test.target))
+        return test.expr if test.if_true == on_true else Not(test.expr)
+
+    # Split into parts which each either jump to target or fall through to the next part
+    groups = []
+    first = 0
+    for i in range(len(tests)):
+        group_end = tests[i + 1].start if i + 1 < len(tests) else end
+        group_start = tests[first].start
+        if all(test.target == target or group_start < test.target <= group_end for test in tests[first:i + 1]):
+            groups.append((tests[first:i + 1], group_end))
+            first = i + 1
+    if len(groups) > 1 and not tests[first:]:
+        conditions = [_condition(group, group_end, target, on_true) for group, group_end in groups]
+        return _combine(Or if on_true else And, conditions)
+
+    # Otherwise, a leading part decides the outcome early by jumping straight to end
+    for split in range(len(tests) - 1, 0, -1):
+        head = tests[:split]
+        head_end = tests[split].start
+        if (
+            all(test.target == end or tests[0].start < test.target <= head_end for test in head)
+            and any(test.target == end for test in head)
+        ):
+            conditions = [
+                _condition(head, head_end, end, not on_true),
+                _condition(tests[split:], end, target, on_true),
+            ]
+            return _combine(And if on_true else Or, conditions)
+    raise NotImplementedError('unrecognised condition')
+
+
+class _Loop(object):
+    __slots__ = ('head', 'assign', 'iter', 'tests', 'end')
+
+    def __init__(self, head, assign, iter):
+        self.head = head
+        self.assign = assign
+        self.iter = iter
+        self.tests = []
+        self.end = None
+
+
+def _call(func, args):
+    if func.__class__ is _Function:
+        if len(args) != 1:
+            raise NotImplementedError('function call')
+        return decompile(func.code, args[0])
+    return CallFunc(func, args)
+
+
+def _load_name(instruction, stack):
+    stack.append(Name(instruction.argval))
+
+
+def _load_global(instruction, stack):
+    if _NULL_GLOBALS and instruction.arg & 1:
+        stack.append(_NULL)
+    stack.append(Name(instruction.argval))
+
+
+def _load_fast_load_fast(instruction, stack):
+    stack.extend(Name(name) for name in instruction.argval)
+
+
+def _load_const(instruction, stack):
+    stack.append(Const(instruction.argval))
+
+
+def _load_attr(instruction, stack):
+    expr = Getattr(stack.pop(), instruction.argval)
+    if _NULL_ATTRS and instruction.arg & 1:
+        stack.append(_NULL)
+    stack.append(expr)
+
+
+def _load_method(instruction, stack):
+    stack.extend((_NULL, Getattr(stack.pop(), instruction.argval)))
+
+
+def _push_null(instruction, stack):
+    stack.append(_NULL)
+
+
+def _compare(op):
+    def handler(instruction, stack):
+        right = stack.pop()
+        stack.append(Compare(stack.pop(), [(op(instruction), right)]))
+    return handler
+
+
+def _unary_not(instruction, stack):
+    stack.append(Not(stack.pop()))
+
+
+def _binary_subtract(instruction, stack):
+    right = stack.pop()
+    stack.append(Sub((stack.pop(), right)))
+
+
+def _binary_subscr(instruction, stack):
+    sub = stack.pop()
+    stack.append(Subscript(stack.pop(), 'OP_APPLY', [sub]))
+
+
+def _binary_op(instruction, stack):
+    if instruction.argrepr == '-':
+        return _binary_subtract(instruction, stack)
+    if instruction.argrepr == '[]':
+        return _binary_subscr(instruction, stack)
+    raise NotImplementedError(instruction.argrepr)
+
+
+def _build(node_type):
+    def handler(instruction, stack):
+        nodes = stack[len(stack) - instruction.arg:]
+        del stack[len(stack) - instruction.arg:]
+        stack.append(node_type(nodes))
+    return handler
+
+
+def _make_function(instruction, stack):
+    code = stack.pop()
+    if not hasattr(code.value, 'co_code'):  # qualified name
+        code = stack.pop()
+    extra = instruction.arg or 0
+    if _FLAGGED_FUNCTIONS:
+        extra = bin(extra).count('1')
+    elif instruction.opname == 'MAKE_CLOSURE':
+        extra += 1
+    del stack[len(stack) - extra:]
+    stack.append(_Function(code.value))
+
+
+def _set_function_attribute(instruction, stack):
+    function = stack.pop()
+    stack.pop()
+    stack.append(function)
+
+
+def _call_function(instruction, stack):
+    args = stack[len(stack) - instruction.arg:]
+    del stack[len(stack) - instruction.arg:]
+    stack.append(_call(stack.pop(), args))
+
+
+def _call_with_self(instruction, stack):
+    args = stack[len(stack) - instruction.arg:]
+    del stack[len(stack) - instruction.arg:]
+    second = stack.pop()
+    first = stack.pop()
+    if first is _NULL:
+        func = second
+    elif second is _NULL:
+        func = first
+    else:  # bound callable and its first argument
+        func = first
+        args.insert(0, second)
+    stack.append(_call(func, args))
+
+
+def _get_iter(instruction, stack):
+    pass
+
+
+_HANDLERS = {
+    'LOAD_FAST': _load_name,
+    'LOAD_DEREF': _load_name,
+    'LOAD_NAME': _load_name,
+    'LOAD_CLOSURE': _load_name,
+    'LOAD_GLOBAL': _load_global,
+    'LOAD_FAST_LOAD_FAST': _load_fast_load_fast,
+    'LOAD_CONST': _load_const,
+    'LOAD_SMALL_INT': _load_const,
+    'LOAD_ATTR': _load_attr,
+    'LOAD_METHOD': _load_method,
+    'PUSH_NULL': _push_null,
+    'COMPARE_OP': _compare(lambda instruction: instruction.argval),
+    'CONTAINS_OP': _compare(lambda instruction: 'not in' if instruction.arg else 'in'),
+    'IS_OP': _compare(lambda instruction: 'is not' if instruction.arg else 'is'),
+    'UNARY_NOT': _unary_not,
+    'BINARY_SUBTRACT': _binary_subtract,
+    'BINARY_SUBSCR': _binary_subscr,
+    'BINARY_OP': _binary_op,
+    'BUILD_TUPLE': _build(Tuple),
+    'BUILD_LIST': _build(List),
+    'MAKE_FUNCTION': _make_function,
+    'MAKE_CLOSURE': _make_function,
+    'SET_FUNCTION_ATTRIBUTE': _set_function_attribute,
+    'CALL_FUNCTION': _call_function,
+    'CALL': _call_with_self,
+    'GET_ITER': _get_iter,
+}
+
+
+def decompile(code, source=None):
+    """
+    Syntax tree of the generator expression compiled to code. If given,
+    source is substituted for the iterable it was called with ('.0').
+    """
+    instructions = _instructions(code)
+    stack = []
+    loops = []
+    operands = []  # (node type, left operand, offset of the end of the right one) of unfinished and/or
+    start = None  # offset at which the expression currently being built started
+    i = 0
+    while i < len(instructions):
+        instruction = instructions[i]
+        opname = instruction.opname
+        if start is None:
+            start = instruction.offset
+        while operands and operands[-1][2] == instruction.offset:
+            node_type, left, __ = operands.pop()
+            stack.append(_combine(node_type, [left, stack.pop()]))
+
+        if opname == 'FOR_ITER':
+            iterable = stack.pop()
+            if source is not None and iterable.__class__ is Name and iterable.name == '.0':
+                iterable = source
+            i += 1
+            store = instructions[i]
+            if store.opname == 'STORE_FAST':
+                name = store.argval
+            elif store.opname == 'STORE_FAST_LOAD_FAST':
+                name, loaded = store.argval
+                stack.append(Name(loaded))
+            else:
+                raise NotImplementedError(store.opname)
+            if loops:
+                loops[-1].end = start
+            loops.append(_Loop(instruction.offset, AssName(name, 'OP_ASSIGN'), iterable))
+            start = None
+
+        elif opname in _CONDITIONAL_JUMPS:
+            if not loops:
+                raise NotImplementedError(opname)
+            loops[-1].tests.append(_Test(start, stack.pop(), opname == 'POP_JUMP_IF_TRUE', instruction.argval))
+            start = None
+
+        elif opname in _SHORT_CIRCUITS:
+            operands.append((_SHORT_CIRCUITS[opname], stack.pop(), instruction.argval))
+
+        elif opname == 'YIELD_VALUE':
+            if not loops or len(stack) != 1:
+                raise NotImplementedError(opname)
+            loops[-1].end = start
+            expr, = stack
+            break
+
+        else:
+            try:
+                handler = _HANDLERS[opname]
+            except KeyError:
+                raise NotImplementedError(opname)
+            handler(instruction, stack)
+        i += 1
+    else:
+        raise NotImplementedError('generator without yield')
+
+    quals = []
+    for loop in loops:
+        ifs = []
+        if loop.tests:
+            ifs.append(GenExprIf(_condition(loop.tests, loop.end, loop.head, False)))
+        quals.append(GenExprFor(loop.assign, loop.iter, ifs))
+    return GenExpr(GenExprInner(expr, quals))
@@ -0,0 +1,71 @@
+"""
+Querying documents straight from their files.
+
+libxml2 reads each file itself as it parses it, so its contents are never
+copied into a Python string first, and parsers are kept per thread (and per set
+of options) rather than being built again for every file.
+"""
+
+import threading
+
+from xpyth import DOM, etree, _bind, _evaluate, _Namespace, _translate
+
+
+_PATH_TYPES = (type(u''), str, bytes)
+
+_parsers = threading.local()  # .cache: (html, options) -> parser, for this thread
+
+
+def parser(html=True, **options):
+    """
+    This thread's HTML (or, if html is unset, XML) parser with the given options,
+    which is created the first time it's asked for; lxml's parsers can't be
+    shared between threads.
+    """
+    try:
+        cache = _parsers.cache
+    except AttributeError:
+        cache = _parsers.cache = {}
+    key = html, tuple(sorted(options.items()))
+    found = cache.get(key)
+    if found is None:
+        found = cache[key] = (etree.HTMLParser if html else etree.XMLParser)(**options)
+    return found
+
+
+def _is_path(value):
+    return isinstance(value, _PATH_TYPES) or hasattr(value, '__fspath__')
+
+
+def root(path, html=True, **options):
+    """
+    Root element of the document in the file at path: as with query(), which is
+    given an element, comprehensions are evaluated from there, not from the document.
+    """
+    if hasattr(path, '__fspath__'):
+        path = path.__fspath__()
+    return etree.parse(path, parser(html, **options)).getroot()
+
+
+def _query_path(translation, bindings, sets, path, html, options, smart_strings, code):
+    return _evaluate(translation, bindings, sets, root(path, html, **options), smart_strings=smart_strings, code=code)
+
+
+def query_file(g, path_or_paths, html=True, parser_options=None, variables=False, membership=False, values=False):
+    """
+    Evaluates a comprehension over DOM against the HTML (or, if html is unset,
+    XML) document in a file, returning its results; given several paths, returns
+    an iterator over each file's results in turn, parsing one file at a time.
+
+    parser_options are passed to lxml's HTMLParser or XMLParser, e.g.
+    {'huge_tree': True}. If values is set, plain strings are returned, as by
+    xpyth.values(), so nothing refers to a document once it has been queried
+    and its tree is freed straight away.
+    """
+    assert g.gi_frame.f_locals['.0'] == DOM, "Only root-level expressions are supported."
+    translation = _translate(g, variables, membership)
+    bindings, sets = _bind(translation, _Namespace(g.gi_frame))
+    args = html, parser_options or {}, not values, g.gi_code
+    if _is_path(path_or_paths):
+        return _query_path(translation, bindings, sets, path_or_paths, *args)
+    return (_query_path(translation, bindings, sets, path, *args) for path in path_or_paths)
@@ -0,0 +1,153 @@
+"""
+Dictionary lookups standing in for tree scans, for the simplest generated
+expressions: a tag, optionally with equality (or membership) tests against
+indexed attributes, and optionally projected onto an attribute or text.
+"""
+
+import re
+
+from xpyth import _instrument, _paths, _evaluator, _LRUCache, _SCALAR_TYPES, etree
+
+
+_TERMS = (
+    ('literal', re.compile(r'''^@([A-Za-z_][\w.\-]*)=("[^"]*"|'[^']*')$''')),
+    ('variable', re.compile(r'^@([A-Za-z_][\w.\-]*)=\$([A-Za-z_]\w*)$')),
+    ('member', re.compile(r'''^xpyth:member\(@([A-Za-z_][\w.\-]*), '([A-Za-z_]\w*)'\)$''')),
+)
+_PROJECTION = re.compile(r'^(@[A-Za-z_][\w.\-]*|text\(\))$')
+_UNINDEXABLE = ()
+
+_plans = _LRUCache()  # expression -> (tag, terms, projection), or _UNINDEXABLE
+
+
+def _disjuncts(predicate):
+    """Splits a predicate on its top-level ors."""
+    terms = []
+    start = 0
+    for i, char, depth in _paths._scan(predicate):
+        if not depth and predicate.startswith(' or ', i):
+            terms.append(predicate[start:i])
+            start = i + len(' or ')
+    terms.append(predicate[start:])
+    return terms
+
+
+def _term(term):
+    for kind, pattern in _TERMS:
+        match = pattern.match(term.strip())
+        if match:
+            attribute, value = match.groups()
+            return attribute, kind, value[1:-1] if kind == 'literal' else value
+    return None
+
+
+def plan(expression):
+    """
+    (tag, terms, projection) for an expression an index can answer, else None.
+    terms are (attribute, kind, value) tuples, any of which may match; kind is
+    one of 'literal', 'variable' (value is a variable name) or 'member' (value
+    names an xpyth:member() set).
+    """
+    cached = _plans.get(expression)
+    if cached is None:
+        cached = _plan(expression) or _UNINDEXABLE
+        _plans.put(expression, cached)
+    return cached or None
+
+
+def _plan(expression):
+    steps = _paths.steps(expression)
+    projection = None
+    if len(steps) == 2 and steps[1][0] == '/' and _PROJECTION.match(steps[1][1]):
+        projection = steps.pop()[1]
+    if len(steps) != 1 or steps[0][0] != '//':
+        return None
+    tag, predicates = _paths.node_test(steps[0][1])
+    if not _paths.is_name(tag) or len(predicates) > 1:
+        return None
+    terms = [_term(term) for predicate in predicates for term in _disjuncts(predicate)]
+    if None in terms:
+        return None
+    return tag, tuple(terms), projection
+
+
+def _nested(elements):
+    """Whether any of elements is within another of them."""
+    found = set(elements)
+    return any(ancestor in found for element in elements for ancestor in element.iterancestors())
+
+
+class DocumentIndex(object):
+    """
+    Elements below a document's root, by tag and by the values of the given
+    attributes, for query(g, index=...) to look up rather than scan for.
+
+    The index is a snapshot: rebuild it if the document changes.
+    """
+
+    def __init__(self, tree, attributes=('id', 'class', 'name')):
+        self.root = tree.getroot() if isinstance(tree, etree._ElementTree) else tree
+        self.attributes = frozenset(attributes)
+        self._elements = list(self.root.iterdescendants(tag=etree.Element))
+        self._positions = {element: i for i, element in enumerate(self._elements)}
+        self._tags = {}
+        self._values = {attribute: {} for attribute in attributes}
+        for element in self._elements:
+            self._tags.setdefault(element.tag, []).append(element)
+            for attribute, values in self._values.items():
+                value = element.get(attribute)
+                if value is not None:
+                    values.setdefault(value, []).append(element)
+
+    def __len__(self):
+        return len(self._elements)
+
+    def _matches(self, tag, terms, bindings, sets):
+        """Elements matching tag and any of terms, in document order, or None if the index can't tell."""
+        if not terms:
+            return self._elements if tag == '*' else self._tags.get(tag, [])
+        found = []
+        for attribute, kind, value in terms:
+            values = self._values.get(attribute)
+            if values is None:
+                return None
+            if kind == 'literal':
+                found.append(values.get(value, ()))
+            elif kind == 'variable':
+                value = bindings[value]
+                if not isinstance(value, _SCALAR_TYPES[:2]):
+                    return None  # compared as a number
+                found.append(values.get(value, ()))
+            else:
+                found.extend(values.get(member, ()) for member in sets[value])
+        elements = [element for elements in found for element in elements]
+        if len(found) > 1:
+            elements = sorted(set(elements), key=self._positions.__getitem__)
+        if tag != '*':
+            elements = [element for element in elements if element.tag == tag]
+        return elements
+
+    def evaluate(self, translation, bindings, sets, dom, smart_strings=True, code=None):
+        """Results of translation against dom, or None if this index can't answer it."""
+        if dom is not self.root:
+            return None
+        query_plan = plan(translation.expression)
+        if query_plan is None:
+            return None
+        instrumented = bool(_instrument.instruments)
+        if instrumented:
+            started = _instrument.clock()
+        tag, terms, projection = query_plan
+        elements = self._matches(tag, terms, bindings, sets)
+        if elements is None:
+            return None
+        if projection is None:
+            results = list(elements)
+        elif projection == 'text()' and _nested(elements):
+            return None  # their text nodes are interleaved, in document order
+        else:
+            project = _evaluator(projection, smart_strings)
+            results = [result for element in elements for result in project(element)]
+        if instrumented:
+            _instrument.evaluated(code, translation.expression, results, started)
+        return results
@@ -0,0 +1,143 @@
+"""
+Hooks for timing and counting what xpyth does, e.g. to export into a metrics pipeline.
+
+Nothing is timed or counted unless an instrument has been registered with
+add_instrument(), so instrumentation costs next to nothing when unused.
+"""
+
+import linecache
+import threading
+import time
+
+
+try:
+    clock = time.perf_counter
+except AttributeError:  # Python 2
+    clock = time.time
+
+PHASES = ('decompile', 'translate', 'compile', 'evaluate')
+
+instruments = []  # registered instruments, in order of registration
+
+
+class Instrument(object):
+    """
+    Receiver of instrumentation events. Subclass it, override whichever methods
+    are of interest, and register an instance with add_instrument().
+
+    code is the code object of the comprehension being handled, or None where
+    an evaluation serves several comprehensions at once (as in query_many).
+    """
+
+    def phase(self, name, seconds, code):
+        """Called as each phase (one of PHASES) of handling a comprehension finishes."""
+
+    def translated(self, code, expression, cached):
+        """Called whenever a comprehension is translated, or its translation is found in the cache."""
+
+    def evaluated(self, code, expression, results, seconds):
+        """Called after an expression has been evaluated against a tree."""
+
+
+def add_instrument(instrument):
+    """Registers instrument to receive events, returning it."""
+    instruments.append(instrument)
+    return instrument
+
+
+def remove_instrument(instrument):
+    """Stops instrument from receiving events."""
+    instruments.remove(instrument)
+
+
+def source(code):
+    """Where a comprehension comes from, and the line it's on, for humans."""
+    if code is None:
+        return '<several comprehensions>'
+    line = linecache.getline(code.co_filename, code.co_firstlineno).strip()
+    return '{}:{}: {}'.format(code.co_filename, code.co_firstlineno, line)
+
+
+def lap(name, started, code):
+    """Reports that the phase which began at started has finished, returning the time it did."""
+    finished = clock()
+    for instrument in instruments:
+        instrument.phase(name, finished - started, code)
+    return finished
+
+
+def translated(code, expression, cached):
+    for instrument in instruments:
+        instrument.translated(code, expression, cached)
+
+
+def evaluated(code, expression, results, started):
+    finished = clock()
+    for instrument in instruments:
+        instrument.phase('evaluate', finished - started, code)
+        instrument.evaluated(code, expression, results, finished - started)
+
+
+class Counters(Instrument):
+    """
+    Running totals: of translations and translation cache hits, of the length
+    of translated expressions, of evaluations and the results they returned,
+    and of the time spent in each phase.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.translations = 0
+        self.cache_hits = 0
+        self.expression_length = 0
+        self.evaluations = 0
+        self.results = 0
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+
+    def snapshot(self):
+        """The current totals, as a flat dict."""
+        with self._lock:
+            totals = {
+                'translations': self.translations,
+                'cache_hits': self.cache_hits,
+                'expression_length': self.expression_length,
+                'evaluations': self.evaluations,
+                'results': self.results,
+            }
+            totals.update(('{}_seconds'.format(name), seconds) for name, seconds in self.seconds.items())
+        return totals
+
+    def phase(self, name, seconds, code):
+        with self._lock:
+            self.seconds[name] += seconds
+
+    def translated(self, code, expression, cached):
+        with self._lock:
+            if cached:
+                self.cache_hits += 1
+            else:
+                self.translations += 1
+                self.expression_length += len(expression)
+
+    def evaluated(self, code, expression, results, seconds):
+        with self._lock:
+            self.evaluations += 1
+            self.results += len(results) if isinstance(results, list) else 1
+
+
+class SlowQueryLog(Instrument):
+    """Logs evaluations taking threshold seconds or longer, with their comprehension and XPath."""
+
+    def __init__(self, threshold=0.1, logger=None):
+        self.threshold = threshold
+        if logger is None:
+            import logging  # only once there's something to log
+            logger = logging.getLogger('xpyth')
+        self.logger = logger
+
+    def evaluated(self, code, expression, results, seconds):
+        if seconds >= self.threshold:
+            self.logger.warning('Slow query (%.3fs) %s -> %s', seconds, source(code), expression)
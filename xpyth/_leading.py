@@ -0,0 +1,115 @@
+"""
+Evaluation of only the leading matches of a query, for first(), exists() and
+query()'s limit.
+
+libxml2 builds a location path's whole node-set before filtering it, even by
+position, so instead the elements which the path's final step could select
+are walked in document order, with lxml's iterators, each being tested by a
+condition which looks at it and its ancestors, until enough of them match.
+Only paths of child and descendant steps by name, whose predicates don't
+depend on position, are evaluated this way.
+
+Testing elements one by one costs several times what libxml2 spends on each
+while building a node-set, so if matches turn out to be rare, the search is
+abandoned in favour of evaluating the query in full: no more than _SPARE
+candidates beyond the limit are ever tested.
+"""
+
+import re
+
+from xpyth import _instrument, _paths, _evaluator, _hoisted, _LRUCache, _membership, etree
+
+
+_AXES = {
+    '/': 'parent',
+    '//': 'ancestor',
+}
+_PROJECTION = re.compile(r'^(@[A-Za-z_][\w.\-]*|text\(\))$')
+_CONTEXT = '[{}::*[count(. | $_xpyth_context) = 1]]'  # the first step must start from the query's context
+_UNPLANNABLE = ()
+_SPARE = 1000
+
+_plans = _LRUCache()  # expression -> (descendants, tag, condition, projection), or _UNPLANNABLE
+
+
+def plan(expression):
+    """
+    (descendants, tag, condition, projection) for an expression whose matches
+    can be tested one element at a time, else None: the elements named tag (or
+    any, for '*') among the context's descendants (or, if descendants is unset,
+    its children) for which condition holds, optionally projected onto an
+    attribute or text.
+    """
+    cached = _plans.get(expression)
+    if cached is None:
+        cached = _plan(expression) or _UNPLANNABLE
+        _plans.put(expression, cached)
+    return cached or None
+
+
+def _plan(expression):
+    steps = _paths.steps(expression)
+    projection = None
+    if len(steps) > 1 and steps[-1][0] == '/' and _PROJECTION.match(steps[-1][1]):
+        projection = steps.pop()[1]
+    condition = None
+    for separator, step in steps:
+        test, predicates = _paths.node_test(step)
+        if separator not in _AXES or not _paths.is_name(test):
+            return None
+        if any(_paths.is_positional(predicate) for predicate in predicates):
+            return None  # positions would be counted along the wrong axis
+        if condition is None:
+            condition = step + (_CONTEXT.format(_AXES[separator]) if len(steps) > 1 else '')
+        else:
+            condition = '{}[{}::{}]'.format(step, _AXES[separator], condition)
+    return len(steps) > 1 or steps[0][0] == '//', test, 'self::' + condition, projection
+
+
+def evaluate(translation, bindings, sets, dom, namespace, limit, smart_strings=True, code=None):
+    """
+    The first limit results of translation against (lxml) dom, or None if they
+    can't be found without evaluating it in full.
+    """
+    query_plan = plan(translation.query_expression)
+    if query_plan is None:
+        return None
+    instrumented = bool(_instrument.instruments)
+    if instrumented:
+        started = _instrument.clock()
+    descendants, tag, condition, projection = query_plan
+    test = None
+    if translation.residual is not None:
+        test, projection = translation.residual
+
+    _membership.sets = sets
+    bindings = dict(_hoisted(translation, dom, bindings), _xpyth_context=dom)
+    check = _evaluator(condition)
+    project = None if projection is None else _evaluator(projection, smart_strings)
+    # Text nodes of a match and of a match within it are interleaved in document order
+    nests = project is not None and not projection.startswith('@')
+
+    def matches(element):
+        return check(element, **bindings) and (test is None or test(element, namespace))
+
+    if tag == '*':
+        tag = etree.Element  # i.e. not comments or processing instructions
+    results = []
+    candidates = dom.iterdescendants(tag) if descendants else dom.iterchildren(tag)
+    for i, element in enumerate(candidates):
+        if len(results) >= limit:
+            break
+        if i == limit + _SPARE:
+            return None
+        if not matches(element):
+            continue
+        if project is None:
+            results.append(element)
+            continue
+        if nests and any(matches(descendant) for descendant in element.iterdescendants(tag)):
+            return None
+        results.extend(project(element))
+    del results[limit:]
+    if instrumented:
+        _instrument.evaluated(code, translation.expression, results, started)
+    return results
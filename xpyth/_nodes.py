@@ -0,0 +1,208 @@
+"""
+Syntax tree nodes for the comprehensions xpyth translates.
+
+These mirror the subset of the old compiler.ast API which the translator
+uses: the same class and attribute names, with getChildren() returning a
+flat tuple of each node's children.
+"""
+
+
+def _flatten(seq):
+    flat = []
+    for item in seq:
+        if item.__class__ in (tuple, list):
+            flat.extend(_flatten(item))
+        else:
+            flat.append(item)
+    return flat
+
+
+class Node(object):
+    __slots__ = ()
+
+    def getChildren(self):
+        return tuple(_flatten(getattr(self, field) for field in self.__slots__))
+
+    def __repr__(self):
+        return '{}({})'.format(
+            self.__class__.__name__,
+            ', '.join(repr(getattr(self, field)) for field in self.__slots__),
+        )
+
+
+class GenExpr(Node):
+    __slots__ = ('code',)
+
+    def __init__(self, code):
+        self.code = code
+
+    def getChildren(self):
+        return self.code,
+
+
+class GenExprInner(Node):
+    __slots__ = ('expr', 'quals')
+
+    def __init__(self, expr, quals):
+        self.expr = expr
+        self.quals = quals
+
+    def getChildren(self):
+        return (self.expr,) + tuple(self.quals)
+
+
+class GenExprFor(Node):
+    __slots__ = ('assign', 'iter', 'ifs')
+
+    def __init__(self, assign, iter, ifs):
+        self.assign = assign
+        self.iter = iter
+        self.ifs = ifs
+
+    def getChildren(self):
+        return (self.assign, self.iter) + tuple(self.ifs)
+
+
+class GenExprIf(Node):
+    __slots__ = ('test',)
+
+    def __init__(self, test):
+        self.test = test
+
+    def getChildren(self):
+        return self.test,
+
+
+class Compare(Node):
+    __slots__ = ('expr', 'ops')
+
+    def __init__(self, expr, ops):
+        self.expr = expr
+        self.ops = ops
+
+
+class Name(Node):
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def getChildren(self):
+        return self.name,
+
+
+class AssName(Node):
+    __slots__ = ('name', 'flags')
+
+    def __init__(self, name, flags='OP_ASSIGN'):
+        self.name = name
+        self.flags = flags
+
+    def getChildren(self):
+        return self.name, self.flags
+
+
+class Const(Node):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def getChildren(self):
+        return self.value,
+
+
+class Getattr(Node):
+    __slots__ = ('expr', 'attrname')
+
+    def __init__(self, expr, attrname):
+        self.expr = expr
+        self.attrname = attrname
+
+    def getChildren(self):
+        return self.expr, self.attrname
+
+
+class CallFunc(Node):
+    __slots__ = ('node', 'args', 'star_args', 'dstar_args')
+
+    def __init__(self, node, args, star_args=None, dstar_args=None):
+        self.node = node
+        self.args = args
+        self.star_args = star_args
+        self.dstar_args = dstar_args
+
+    def getChildren(self):
+        return (self.node,) + tuple(self.args) + (self.star_args, self.dstar_args)
+
+
+class Subscript(Node):
+    __slots__ = ('expr', 'flags', 'subs')
+
+    def __init__(self, expr, flags, subs):
+        self.expr = expr
+        self.flags = flags
+        self.subs = subs
+
+    def getChildren(self):
+        return (self.expr, self.flags) + tuple(self.subs)
+
+
+class Not(Node):
+    __slots__ = ('expr',)
+
+    def __init__(self, expr):
+        self.expr = expr
+
+    def getChildren(self):
+        return self.expr,
+
+
+class And(Node):
+    __slots__ = ('nodes',)
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def getChildren(self):
+        return tuple(self.nodes)
+
+
+class Or(Node):
+    __slots__ = ('nodes',)
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def getChildren(self):
+        return tuple(self.nodes)
+
+
+class Tuple(Node):
+    __slots__ = ('nodes',)
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def getChildren(self):
+        return tuple(self.nodes)
+
+
+class List(Node):
+    __slots__ = ('nodes',)
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def getChildren(self):
+        return tuple(self.nodes)
+
+
+class Sub(Node):
+    __slots__ = ('left', 'right')
+
+    def __init__(self, leftright):
+        self.left, self.right = leftright
+
+    def getChildren(self):
+        return self.left, self.right
@@ -0,0 +1,175 @@
+"""
+Rewrites of generated expressions into cheaper equivalents.
+
+optimize() applies rewrites which leave a plain XPath string, suitable for
+xpath(). hoist() goes further for expressions xpyth evaluates itself: it
+moves tests of subqueries which don't depend on the context node out into
+variables, so that they're evaluated once rather than once per candidate node.
+"""
+
+import re
+
+from xpyth import _paths
+
+
+_WORD = re.compile(r'[\w.\-]')
+_OPERATORS = ('and', 'or', 'div', 'mod')
+_COUNT_COMPARISON = re.compile(r'\s*(=|!=|>)\s*0(?![\d.])')
+_REDUNDANT_DESCENDANT = '//*//'
+_PATH_STOP = frozenset(' \t\n,=!<>|+])')
+_FUNCTION = re.compile(r'([\w:\-]+)\(')
+_CHEAP_FUNCTIONS = frozenset(('not', 'true', 'false', 'text'))
+_BOOLEAN_BEFORE = re.compile(r'(\[|\b(not|boolean)\(|\s(and|or))\s*$')
+_BOOLEAN_AFTER = re.compile(r'\s*(\]|\)|(and|or)\b)')
+
+
+def _outside_literals(expression):
+    """Mask of whether each character is outside a string literal."""
+    mask = [True] * len(expression)
+    quote = None
+    for i, char in enumerate(expression):
+        if quote:
+            mask[i] = False
+            if char == quote:
+                quote = None
+        elif char in '\'"':
+            quote = char
+            mask[i] = False
+    return mask
+
+
+def _closing(expression, start):
+    """Index of the bracket closing the one opened at start."""
+    for i, char, depth in _paths._scan(expression[start:]):
+        if depth == 0:
+            return start + i
+    raise ValueError(expression)
+
+
+def _rewrite_counts(expression):
+    """count(x)=0 -> not(x), and count(x)!=0, count(x)>0 -> boolean(x)."""
+    mask = _outside_literals(expression)
+    i = 0
+    while True:
+        i = expression.find('count(', i)
+        if i == -1:
+            return expression
+        if not mask[i] or i and _WORD.match(expression[i - 1]):
+            i += 1
+            continue
+        end = _closing(expression, i + len('count'))
+        comparison = _COUNT_COMPARISON.match(expression, end + 1)
+        if comparison is None:
+            i += 1
+            continue
+        function = 'not' if comparison.group(1) == '=' else 'boolean'
+        argument = expression[i + len('count('):end]
+        expression = '{}{}({}){}'.format(expression[:i], function, argument, expression[comparison.end():])
+        mask = _outside_literals(expression)
+
+
+def _collapse_descendants(expression):
+    """x//*//y -> x/*//y: both select the y at least two levels below x."""
+    mask = _outside_literals(expression)
+    i = expression.find(_REDUNDANT_DESCENDANT)
+    while i != -1:
+        if mask[i]:
+            expression = expression[:i] + expression[i + 1:]
+            mask = mask[:i] + mask[i + 1:]
+        i = expression.find(_REDUNDANT_DESCENDANT, i + 1)
+    return expression
+
+
+def optimize(expression):
+    return _collapse_descendants(_rewrite_counts(expression))
+
+
+def cost(expression):
+    """Rough relative cost of evaluating a predicate term against each candidate node."""
+    stripped = _paths.strip_literals(expression)
+    if _absolute_paths(stripped, inside_predicates=False):
+        return 4  # scans the whole document
+    if '//' in stripped or 'descendant' in stripped or 'following::' in stripped or 'preceding::' in stripped:
+        return 3  # scans a subtree
+    if '/' in stripped or '::' in stripped:
+        return 2  # visits neighbouring nodes
+    if any(function not in _CHEAP_FUNCTIONS for function in _FUNCTION.findall(stripped)):
+        return 1  # string functions and the like
+    return 0  # attribute and text comparisons
+
+
+def _starts_path(expression, i):
+    """Whether the '/' at i starts an absolute location path, rather than continuing one."""
+    before = expression[:i].rstrip()
+    if not before or before[-1] in '[(,=!<>|+':
+        return True
+    words = before.split()
+    return before[-1].isalpha() and words[-1] in _OPERATORS and len(words) > 1
+
+
+def _path_end(expression, start):
+    i = start
+    while i < len(expression):
+        char = expression[i]
+        if char in '[(':
+            i = _closing(expression, i) + 1
+        elif char in _PATH_STOP:
+            break
+        else:
+            i += 1
+    return i
+
+
+def _absolute_paths(expression, inside_predicates=True):
+    """(start, end) of each outermost absolute location path, optionally only those within predicates."""
+    mask = _outside_literals(expression)
+    brackets = []
+    spans = []
+    i = 0
+    while i < len(expression):
+        char = expression[i]
+        if mask[i]:
+            if char in '[(':
+                brackets.append(char)
+            elif char in '])':
+                brackets.pop()
+            elif char == '/' and ('[' in brackets or not inside_predicates) and _starts_path(expression, i):
+                end = _path_end(expression, i)
+                spans.append((i, end))
+                i = end
+                continue
+        i += 1
+    return spans
+
+
+def _in_boolean_context(expression, start, end):
+    """Whether only the truth of the path spanning start:end matters, e.g. in [//p], not(//p) or [@id and //p]."""
+    return bool(_BOOLEAN_BEFORE.search(expression[:start]) and _BOOLEAN_AFTER.match(expression[end:]))
+
+
+def hoist(expression, prefix='_xpyth_h'):
+    """
+    Moves absolute location paths whose truth is all that's tested out of
+    predicates, returning (expression, hoisted), where hoisted is a tuple of
+    (variable name, boolean expression) to be evaluated, in order, and bound
+    before expression is. They may refer to the variables of those hoisted
+    before them.
+
+    Only booleans are hoisted: libxml2 copies a node-set variable each time
+    it's read, which, once per candidate node, costs more than the subquery.
+    """
+    hoisted = []
+
+    def rewrite(expression):
+        spans = [
+            (start, end) for start, end in _absolute_paths(expression)
+            if _in_boolean_context(expression, start, end)
+        ]
+        for start, end in reversed(spans):
+            path = rewrite(expression[start:end])
+            name = '{}{}'.format(prefix, len(hoisted))
+            hoisted.append((name, 'boolean({})'.format(path)))
+            expression = '{}${}{}'.format(expression[:start], name, expression[end:])
+        return expression
+
+    return rewrite(expression), tuple(hoisted)
@@ -0,0 +1,149 @@
+"""
+Evaluation of descendant queries against huge documents, split across threads.
+
+The document is split into disjoint subtrees, each of which is searched by a
+thread of its own; libxml2 releases the GIL while it does so. Only queries
+whose matches can be found within a subtree without looking outside of it are
+split: //tag[...] searches, optionally followed by further child or descendant
+steps, whose predicates only look at the node they're testing.
+"""
+
+import atexit
+import re
+import threading
+
+from xpyth import (
+    etree, _bind, _document, _evaluate, _evaluator, _instrument, _is_lxml, _membership, _Namespace,
+    _paths, _translate,
+)
+
+
+_PROJECTION = re.compile(r'^(@[A-Za-z_][\w.\-]*|text\(\))$')
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def _cpus():
+    import multiprocessing  # only once a query is split
+    return multiprocessing.cpu_count()
+
+
+def _pool():
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            import multiprocessing.pool
+            _default_pool = multiprocessing.pool.ThreadPool(_cpus())
+            atexit.register(_close_pool)
+    return _default_pool
+
+
+def _close_pool():
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is not None:
+            _default_pool.close()
+            _default_pool.join()
+            _default_pool = None
+
+
+def plan(expression):
+    """
+    (first step, remaining steps, projection) of a query which can be split
+    between subtrees, else None.
+    """
+    steps = _paths.steps(expression)
+    projection = ''
+    if len(steps) > 1 and steps[-1][0] == '/' and _PROJECTION.match(steps[-1][1]):
+        projection = _paths.join([steps.pop()])
+    if steps[0][0] != '//':
+        return None
+    for separator, step in steps:
+        test, predicates = _paths.node_test(step)
+        if separator not in ('/', '//') or not _paths.is_name(test):
+            return None
+        if not all(_paths.is_node_local(predicate) for predicate in predicates):
+            return None
+    return steps[0][1], _paths.join(steps[1:]), projection
+
+
+def _partitions(root, count):
+    """
+    (element, whole) pairs, in document order, covering root's descendants: whole
+    elements stand for their subtree, and the others, which have been split
+    into their children, only for themselves.
+    """
+    partitions = [(child, True) for child in root.iterchildren(tag=etree.Element)]
+    while len(partitions) < count:
+        sizes = [len(element) if whole else 0 for element, whole in partitions]
+        largest = max(range(len(partitions)), key=sizes.__getitem__)
+        if sizes[largest] < 2:
+            break
+        element = partitions[largest][0]
+        children = [(child, True) for child in element.iterchildren(tag=etree.Element)]
+        partitions[largest:largest + 1] = [(element, False)] + children
+    return partitions
+
+
+def _chunks(items, count):
+    size = -(-len(items) // count)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _search(job):
+    partitions, subtree_expression, self_expression, bindings, sets, smart_strings = job
+    _membership.sets = sets
+    subtree = _evaluator(subtree_expression, smart_strings)  # this thread's
+    itself = _evaluator(self_expression, smart_strings)
+    results = []
+    for element, whole in partitions:
+        results.extend((subtree if whole else itself)(element, **bindings))
+    return results
+
+
+def parallel_query(g, variables=False, membership=False, workers=None, pool=None, smart_strings=True):
+    """
+    Queries an lxml tree as query() does, but splits the search between threads
+    when the query allows it; results are still in document order.
+
+    The document is split into a couple of pieces per worker (by default, per
+    CPU), which are searched in pool: a multiprocessing.pool.ThreadPool or
+    concurrent.futures.ThreadPoolExecutor, by default one with a thread per CPU.
+    """
+    try:
+        dom = _document(g.gi_frame.f_locals['.0'])
+    except StopIteration:
+        return []
+    translation = _translate(g, variables, membership)
+    bindings, sets = _bind(translation, _Namespace(g.gi_frame))
+    query_plan = None if translation.hoisted or not _is_lxml(dom) else plan(translation.expression)
+    if query_plan is None:
+        return _evaluate(translation, bindings, sets, dom, smart_strings=smart_strings, code=g.gi_code)
+
+    first, rest, projection = query_plan
+    workers = workers or _cpus()
+    partitions = _partitions(dom, 4 * workers)
+    if not partitions:
+        return []
+    if rest or projection == '/text()':
+        # Further steps from an element split into its children would search their subtrees
+        # too, duplicating what's found there, and its own text would come before theirs,
+        # rather than interleaved with it; such elements are few, so check for them
+        _membership.sets = sets
+        matches = _evaluator('self::' + first)
+        if any(matches(element, **bindings) for element, whole in partitions if not whole):
+            return _evaluate(translation, bindings, sets, dom, smart_strings=smart_strings, code=g.gi_code)
+
+    instrumented = bool(_instrument.instruments)
+    if instrumented:
+        started = _instrument.clock()
+    jobs = [
+        (chunk, 'descendant-or-self::' + first + rest + projection, 'self::' + first + rest + projection, bindings, sets, smart_strings)
+        for chunk in
+        _chunks(partitions, 2 * workers)
+    ]
+    results = [result for found in (pool or _pool()).map(_search, jobs) for result in found]
+    if instrumented:
+        _instrument.evaluated(g.gi_code, translation.expression, results, started)
+    return results
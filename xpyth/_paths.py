@@ -0,0 +1,110 @@
+"""Helpers for taking apart the location paths xpyth generates."""
+
+import re
+
+
+_LITERAL = re.compile(r'"[^"]*"|\'[^\']*\'')
+_NAME = re.compile(r'^(\*|[A-Za-z_][\w.\-]*)$')
+_POSITIONAL = re.compile(r'^\s*\d+\s*$|\b(position|last)\(')
+_NUMERIC = re.compile(r'^\s*(count|sum|string-length|number|floor|ceiling|round)\(')
+_ARITHMETIC = re.compile(r'^\s*($|[-+*]|div\b|mod\b)')
+
+
+def _scan(expression):
+    """Yields (index, char, depth) for characters outside of string literals."""
+    depth = 0
+    quote = None
+    for i, char in enumerate(expression):
+        if quote:
+            if char == quote:
+                quote = None
+            continue
+        if char in '\'"':
+            quote = char
+        elif char in '[(':
+            depth += 1
+        elif char in '])':
+            depth -= 1
+        yield i, char, depth
+
+
+def steps(expression):
+    """
+    Splits a location path into (separator, step) pairs, e.g.
+    "//div[@id='a']/@href" -> [('//', "div[@id='a']"), ('/', '@href')].
+    """
+    result = []
+    separator = ''
+    start = 0
+    skip = False
+    for i, char, depth in _scan(expression):
+        if skip:
+            skip = False
+            continue
+        if char != '/' or depth:
+            continue
+        if i > start or result or separator:
+            result.append((separator, expression[start:i]))
+        separator = '/'
+        if expression[i + 1:i + 2] == '/':
+            separator = '//'
+            skip = True
+        start = i + len(separator)
+    result.append((separator, expression[start:]))
+    return result
+
+
+def join(steps):
+    """Inverse of steps()."""
+    return ''.join(separator + step for separator, step in steps)
+
+
+def node_test(step):
+    """Splits a step into its node test and the list of its predicates."""
+    predicates = []
+    test_end = None
+    start = None
+    for i, char, depth in _scan(step):
+        if char == '[' and depth == 1:
+            if test_end is None:
+                test_end = i
+            start = i + 1
+        elif char == ']' and depth == 0:
+            predicates.append(step[start:i])
+    return step[:test_end].strip(), predicates
+
+
+def is_name(test):
+    """Whether a node test selects elements by name (or wildcard) only."""
+    return bool(_NAME.match(test))
+
+
+def strip_literals(expression):
+    return _LITERAL.sub("''", expression)
+
+
+def is_node_local(predicate):
+    """Whether a predicate only looks at the context node's own attributes and text."""
+    stripped = strip_literals(predicate)
+    return not (
+        '/' in stripped
+        or '::' in stripped
+        or '..' in stripped
+        or _POSITIONAL.search(stripped)
+    )
+
+
+def is_positional(predicate):
+    """Whether a predicate may depend on the context node's position, e.g. [1], [last()] or [count(p)]."""
+    stripped = strip_literals(predicate)
+    if _POSITIONAL.search(stripped):
+        return True
+    if not _NUMERIC.match(stripped):
+        return False
+    call_end = next(i for i, char, depth in _scan(stripped) if char == ')' and depth == 0)
+    return bool(_ARITHMETIC.match(stripped[call_end + 1:]))  # a number, rather than a comparison of one
+
+
+def uses_text(expression):
+    """Whether an expression looks at text content."""
+    return 'text()' in strip_literals(expression)
@@ -0,0 +1,166 @@
+"""
+xpyth-compile: ahead-of-time translation of the comprehensions in a codebase.
+
+It finds comprehensions passed to xpyth's functions in the given modules,
+translates them, and writes the translations to a table which xpyth.load_precompiled()
+(or the XPYTH_PRECOMPILED environment variable) loads; see xpyth._aot.
+
+Only translations that don't depend on captured values, and which XPath can
+express entirely, can be made ahead of time; the rest are left to be
+translated at runtime, and comprehensions which can't be translated at all
+are reported instead.
+
+    xpyth-compile [-o xpyth_precompiled.json] path [path ...]
+"""
+
+from __future__ import print_function
+
+import argparse
+import ast
+import json
+import os
+import sys
+import types
+
+from xpyth import _translate_code
+from xpyth._aot import digest, version
+
+
+ENTRY_POINTS = frozenset((
+    'xpath', 'query', 'values', 'first', 'exists', 'compile', 'Query', 'stream_query', 'aquery', 'query_file',
+    'query_table', 'query_batch',
+))
+MANY_ENTRY_POINTS = frozenset(('query_many', 'aquery_many'))  # comprehensions are the values of a dict
+HYBRID_ENTRY_POINTS = frozenset(('query', 'values', 'first', 'exists', 'query_table'))  # leave Python a residual
+OPTIONS = False, False  # variables and membership, as translations are made with
+
+
+class _Unbound(object):
+    """Namespace in which no names are bound, for translating without a frame."""
+
+    def get(self, name, default=None):
+        return default
+
+    def __getitem__(self, name):
+        raise KeyError(name)
+
+
+def _targets(tree):
+    """
+    Line numbers of comprehensions passed to xpyth's functions, with how many
+    are on each and whether any is passed to a function which translates hybrid.
+    """
+    lines = {}
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        function = node.func
+        name = function.attr if isinstance(function, ast.Attribute) else getattr(function, 'id', None)
+        if name in ENTRY_POINTS and node.args:
+            candidates = node.args[:1]
+        elif name in MANY_ENTRY_POINTS and node.args and isinstance(node.args[0], ast.Dict):
+            candidates = node.args[0].values
+        else:
+            continue
+        for candidate in candidates:
+            if isinstance(candidate, ast.GeneratorExp):
+                count, hybrid = lines.get(candidate.lineno, (0, False))
+                lines[candidate.lineno] = count + 1, hybrid or name in HYBRID_ENTRY_POINTS
+    return lines
+
+
+def _comprehensions(code):
+    """Code objects of the comprehensions within code, in order, but not of those nested in comprehensions."""
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            if const.co_name == '<genexpr>':
+                yield const
+            else:
+                for comprehension in _comprehensions(const):
+                    yield comprehension
+
+
+def compile_file(path):
+    """
+    Translates the comprehensions in a module passed to xpyth, returning
+    ({digest: translation}, number left to be translated at runtime, [(line, error)]).
+    Those left are the ones which depend on captured values, or which have
+    conditions for Python to test, as these can't be stored.
+    """
+    with open(path, 'rb') as f:
+        source = f.read()
+    targets = _targets(ast.parse(source, path))
+    by_line = {}
+    for comprehension in _comprehensions(compile(source, path, 'exec', dont_inherit=True)):
+        by_line.setdefault(comprehension.co_firstlineno, []).append(comprehension)
+
+    compiled = {}
+    dynamic = 0
+    errors = []
+    for line, (count, hybrid) in sorted(targets.items()):
+        comprehensions = by_line.get(line, [])
+        exact = len(comprehensions) == count  # otherwise, others share the line and failures may be theirs
+        for comprehension in comprehensions:
+            try:
+                translation, scope = _translate_code(comprehension, _Unbound(), *OPTIONS, hybrid=hybrid)
+            except Exception as e:  # anything translating may raise
+                if exact:
+                    errors.append((line, '{}: {}'.format(e.__class__.__name__, e)))
+                continue
+            if scope.reads or scope.typed or translation.residual is not None:
+                dynamic += 1
+                continue
+            compiled[digest(comprehension)] = [
+                translation.expression, translation.hoisted, translation.query_expression, list(OPTIONS),
+            ]
+    return compiled, dynamic, errors
+
+
+def _modules(paths):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for directory, __, filenames in os.walk(path):
+            for filename in sorted(filenames):
+                if filename.endswith('.py'):
+                    yield os.path.join(directory, filename)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='xpyth-compile',
+        description='Translates the comprehensions in Python modules ahead of time.',
+    )
+    parser.add_argument('paths', nargs='+', help='modules, or directories to search for them')
+    parser.add_argument('-o', '--output', default='xpyth_precompiled.json', help='table to write (or add) to')
+    args = parser.parse_args(argv)
+
+    table = {}
+    if os.path.exists(args.output):
+        with open(args.output) as f:
+            table = json.load(f)  # keep other Python versions' translations
+    compiled = table[version()] = {}
+    dynamic = 0
+    failures = 0
+    for path in _modules(args.paths):
+        try:
+            translated, needs_values, errors = compile_file(path)
+        except SyntaxError as e:
+            print('{}: {}'.format(path, e), file=sys.stderr)
+            failures += 1
+            continue
+        compiled.update(translated)
+        dynamic += needs_values
+        for line, error in errors:
+            print('{}:{}: {}'.format(path, line, error), file=sys.stderr)
+        failures += len(errors)
+
+    with open(args.output, 'w') as f:
+        json.dump(table, f, indent=1, sort_keys=True)
+    print('{} comprehensions translated, {} left to runtime, {} failed'.format(len(compiled), dynamic, failures))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
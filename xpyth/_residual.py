@@ -0,0 +1,135 @@
+"""
+Conditions XPath can't express, compiled into Python closures which are applied
+to the elements the rest of the comprehension selects.
+
+Within these, attributes of the comprehension's node read as the values of the
+element's attributes (or its text), missing ones as empty strings, as XPath's
+string() has them; the node itself is the element.
+"""
+
+import operator
+
+try:
+    import builtins
+except ImportError:  # Python 2
+    import __builtin__ as builtins
+
+from xpyth import _ATTR_REPLACEMENTS, _evaluator, _stdlib
+from xpyth._nodes import And, CallFunc, Compare, Const, GenExprIf, Getattr, List, Name, Not, Or, Sub, Subscript, Tuple
+
+
+_COMPARISONS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda a, b: a in b,
+    'not in': lambda a, b: a not in b,
+    'is': operator.is_,
+    'is not': operator.is_not,
+}
+
+_MISSING = object()
+
+
+def attribute(node, target):
+    """Name of the element attribute node reads (text for its text), if it's an attribute of target, else None."""
+    if node.__class__ == Getattr and node.expr.__class__ == Name and node.expr.name == target:
+        name = node.attrname
+    elif (
+        node.__class__ == Sub and node.right.__class__ == Name
+        and node.left.__class__ == Getattr and node.left.expr.__class__ == Name and node.left.expr.name == target
+    ):  # dashed attribute, e.g. X.data-bind
+        name = '{}-{}'.format(node.left.attrname, node.right.name)
+    else:
+        return None
+    return _ATTR_REPLACEMENTS.get(name, name)
+
+
+def _lookup(name):
+    def lookup(element, namespace):
+        value = namespace.get(name, _MISSING)
+        if value is _MISSING:
+            value = getattr(builtins, name)
+        return value
+    return lookup
+
+
+def value(node, target):
+    """Closure (element, namespace) -> the value of node."""
+    ntype = node.__class__
+    if ntype == GenExprIf:
+        return value(node.test, target)
+    if ntype == Const:
+        constant = node.value
+        return lambda element, namespace: constant
+    if ntype == Name:
+        if node.name == target:
+            return lambda element, namespace: element
+        return _lookup(node.name)
+    name = attribute(node, target)
+    if name == 'text':
+        return lambda element, namespace: element.text or ''
+    if name is not None:
+        return lambda element, namespace: element.get(name, '')
+    if ntype == Getattr:
+        name = node.attrname
+        expr = value(node.expr, target)
+        return lambda element, namespace: getattr(expr(element, namespace), name)
+    if ntype == Sub:
+        left, right = value(node.left, target), value(node.right, target)
+        return lambda element, namespace: left(element, namespace) - right(element, namespace)
+    if ntype == Compare:
+        expr = value(node.expr, target)
+        (op, other), = node.ops
+        compare = _COMPARISONS[op]
+        other = value(other, target)
+        return lambda element, namespace: compare(expr(element, namespace), other(element, namespace))
+    if ntype == Not:
+        expr = value(node.expr, target)
+        return lambda element, namespace: not expr(element, namespace)
+    if ntype in (And, Or):
+        nodes = [value(child, target) for child in node.nodes]
+        combine = all if ntype == And else any
+        return lambda element, namespace: combine(child(element, namespace) for child in nodes)
+    if ntype == CallFunc:
+        if node.star_args is not None or node.dstar_args is not None:
+            raise NotImplementedError(node)
+        function = value(node.node, target)
+        args = [value(arg, target) for arg in node.args]
+        return lambda element, namespace: function(element, namespace)(*[arg(element, namespace) for arg in args])
+    if ntype == Subscript:
+        expr = value(node.expr, target)
+        sub, = [value(sub, target) for sub in node.subs]
+        return lambda element, namespace: expr(element, namespace)[sub(element, namespace)]
+    if ntype in (Tuple, List):
+        nodes = [value(child, target) for child in node.nodes]
+        build = tuple if ntype == Tuple else list
+        return lambda element, namespace: build(child(element, namespace) for child in nodes)
+    raise NotImplementedError(ntype.__name__)
+
+
+def predicate(conditions, target):
+    """Closure (element, namespace) -> whether element meets all conditions, with target naming it."""
+    compiled = [value(condition, target) for condition in conditions]
+    return lambda element, namespace: all(condition(element, namespace) for condition in compiled)
+
+
+def apply(residual, elements, namespace, smart_strings=True):
+    """Filters elements by a translation's residual conditions, projecting what's left as it says."""
+    test, projection = residual
+    elements = [element for element in elements if test(element, namespace)]
+    if projection is None:
+        return elements
+    project = None
+    results = []
+    for element in elements:
+        if project is None:
+            project = (
+                _stdlib.evaluator(projection) if _stdlib.is_element(element)
+                else _evaluator(projection, smart_strings)
+            )
+        results.extend(project(element))
+    return results
@@ -0,0 +1,85 @@
+"""
+Evaluation of generated expressions in a browser, through Selenium.
+
+Every expression is evaluated by a single execute_script() call running
+document.evaluate(), which returns elements and attribute or text values alike,
+rather than by find_elements() followed by a get_attribute() round trip per
+element.
+"""
+
+import re
+
+from xpyth import _instrument, _literal, _optimize
+
+
+_SCRIPT = '''
+var context = arguments[1] || document;
+return arguments[0].map(function (expression) {
+    var snapshot = document.evaluate(expression, context, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    var results = [];
+    for (var i = 0; i < snapshot.snapshotLength; i++) {
+        var node = snapshot.snapshotItem(i);
+        results.push(node.nodeType === Node.ELEMENT_NODE ? node : node.nodeValue);
+    }
+    return results;
+});
+'''
+
+_VARIABLE = re.compile(r'\$([A-Za-z_]\w*)')
+_EXSLT = re.compile(r'\bre:[\w-]+\(')
+
+
+def is_remote(dom):
+    """Whether dom is a Selenium WebDriver or WebElement."""
+    return hasattr(dom, 'execute_script') or hasattr(getattr(dom, 'parent', None), 'execute_script')
+
+
+def _inline(expression, bindings):
+    """expression with its variables replaced by literals, as browsers can't bind them."""
+    mask = _optimize._outside_literals(expression)
+
+    def literal(match):
+        if not mask[match.start()]:
+            return match.group(0)
+        value = _literal(bindings[match.group(1)])
+        if value is None:
+            raise NotImplementedError(match.group(0))
+        return value
+    return _VARIABLE.sub(literal, expression)
+
+
+def _check_functions(expression):
+    """Raises NotImplementedError if expression calls EXSLT functions, which browsers lack."""
+    mask = _optimize._outside_literals(expression)
+    for match in _EXSLT.finditer(expression):
+        if mask[match.start()]:
+            raise NotImplementedError(match.group(0)[:-1])  # re:test() only exists in lxml
+
+
+def evaluate_many(translations, dom, codes=None):
+    """
+    Evaluates (translation, bindings, sets) triples against a WebDriver (i.e. its
+    document) or WebElement in one round trip, returning a list of their results.
+    """
+    expressions = []
+    for translation, bindings, sets in translations:
+        if sets:
+            raise NotImplementedError('membership')  # xpyth:member() only exists in lxml
+        _check_functions(translation.expression)
+        expressions.append('.' + _inline(translation.expression, bindings))
+    instrumented = bool(_instrument.instruments)
+    if instrumented:
+        started = _instrument.clock()
+    if hasattr(dom, 'execute_script'):
+        results = dom.execute_script(_SCRIPT, expressions, None)
+    else:
+        results = dom.parent.execute_script(_SCRIPT, expressions, dom)
+    if instrumented:
+        for (translation, __, __), code, result in zip(translations, codes or [None] * len(results), results):
+            _instrument.evaluated(code, translation.expression, result, started)
+    return results
+
+
+def evaluate(translation, bindings, sets, dom, code=None):
+    """Evaluates translation against a WebDriver or WebElement."""
+    return evaluate_many([(translation, bindings, sets)], dom, [code])[0]
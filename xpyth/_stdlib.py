@@ -0,0 +1,529 @@
+"""
+Evaluation of generated expressions against xml.etree elements, by compiling
+them into Python closures (ElementPath itself only supports a sliver of XPath).
+"""
+
+import itertools
+import re
+
+from xpyth import _LRUCache, _text
+
+
+_TOKEN = re.compile(r'''\s*(?:
+    (?P<literal>"[^"]*"|'[^']*')
+  | (?P<number>\d+(?:\.\d*)?|\.\d+)
+  | (?P<op>//|/|::|\.\.|\.|!=|<=|>=|=|<|>|\(|\)|\[|\]|,|@|\*|\$)
+  | (?P<name>[A-Za-z_][\w.\-]*(?::[A-Za-z_][\w.\-]*)?)
+)''', re.X)
+
+_COMPARISONS = {
+    '=': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '>': lambda a, b: a > b,
+    '<=': lambda a, b: a <= b,
+    '>=': lambda a, b: a >= b,
+}
+
+_NODE_TYPES = ('text', 'node')
+
+_STRING_TYPES = (type(u''), str)
+
+_evaluators = _LRUCache()  # expression -> compiled closure
+
+
+def is_element(dom):
+    """Whether dom is an xml.etree (rather than lxml) element."""
+    return hasattr(dom, 'iter') and hasattr(dom, 'findall') and not hasattr(dom, 'xpath')
+
+
+def evaluator(expression):
+    """
+    Closure evaluating expression against an element, optionally with variable
+    bindings and sets for xpyth:member() lookups.
+    """
+    compiled = _evaluators.get(expression)
+    if compiled is None:
+        compiled = _Parser(expression).parse()
+        _evaluators.put(expression, compiled)
+
+    def evaluate(element, bindings=None, sets=None):
+        return compiled(element, _Environment(element, bindings or {}, sets or {}))
+    return evaluate
+
+
+class _Environment(object):
+    """Per-evaluation state: the root, parent pointers and document order (built on demand)."""
+
+    def __init__(self, root, bindings, sets):
+        self.root = root
+        self.document = _Document(root)
+        self.bindings = bindings
+        self.sets = sets
+        self._parents = None
+        self._positions = None
+
+    def parent(self, element):
+        if self._parents is None:
+            self._parents = {child: parent for parent in self.root.iter() for child in parent}
+            self._parents[self.root] = self.document
+        return self._parents.get(element)
+
+    def position(self, element):
+        if self._positions is None:
+            self._positions = {node: i for i, node in enumerate(self.root.iter())}
+            self._positions[self.document] = -1
+        return self._positions[element]
+
+
+class _Document(object):
+    """Stand-in for the document node, whose only child is the root element."""
+    tag = text = tail = None
+
+    def __init__(self, root):
+        self.root = root
+
+    def __iter__(self):
+        return iter([self.root])
+
+    def iter(self, tag=None):
+        return itertools.chain([self] if tag is None else [], self.root.iter(tag))
+
+    def get(self, key, default=None):
+        return default
+
+    @property
+    def attrib(self):
+        return {}
+
+
+def _is_element(node):
+    return isinstance(getattr(node, 'tag', None), _STRING_TYPES)
+
+
+def _string_value(node):
+    if isinstance(node, _STRING_TYPES):
+        return node
+    if isinstance(node, _Document):
+        node = node.root
+    return ''.join(node.itertext())
+
+
+def _string(value):
+    if isinstance(value, list):
+        return _string_value(value[0]) if value else ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, float):
+        return repr(int(value)) if value.is_integer() else repr(value)
+    return value
+
+
+def _number(value):
+    if isinstance(value, float):
+        return value
+    if isinstance(value, bool):
+        return float(value)
+    try:
+        return float(_string(value))
+    except ValueError:
+        return float('nan')
+
+
+def _boolean(value):
+    if isinstance(value, float):
+        return value != 0 and value == value
+    return bool(value)
+
+
+def _compare(op, left, right):
+    """XPath 1.0 comparison, including existential comparisons of node-sets."""
+    compare = _COMPARISONS[op]
+    if isinstance(left, list) and isinstance(right, list):
+        right_values = [_string_value(node) for node in right]
+        if op not in ('=', '!='):
+            right_values = [_number(value) for value in right_values]
+        return any(
+            compare(_string_value(node) if op in ('=', '!=') else _number(_string_value(node)), value)
+            for node in left
+            for value in right_values
+        )
+    if isinstance(left, list) or isinstance(right, list):
+        flipped = not isinstance(left, list)
+        nodes, other = (right, left) if flipped else (left, right)
+        if isinstance(other, bool):
+            return _compare(op, other, _boolean(nodes)) if flipped else _compare(op, _boolean(nodes), other)
+        convert = _number if isinstance(other, float) or op not in ('=', '!=') else _string_value
+        other = _number(other) if convert is _number else other
+        return any(
+            compare(other, convert(node)) if flipped else compare(convert(node), other)
+            for node in nodes
+        )
+    if op in ('=', '!='):
+        if isinstance(left, bool) or isinstance(right, bool):
+            return compare(_boolean(left), _boolean(right))
+        if isinstance(left, float) or isinstance(right, float):
+            return compare(_number(left), _number(right))
+        return compare(_string(left), _string(right))
+    return compare(_number(left), _number(right))
+
+
+def _member(nodes, name, env):
+    members = env.sets[_string(name)]
+    if not isinstance(nodes, list):
+        nodes = [nodes]
+    return any(_string_value(node) in members for node in nodes)
+
+
+_FUNCTIONS = {
+    'not': lambda env, value: not _boolean(value),
+    'boolean': lambda env, value: _boolean(value),
+    'true': lambda env: True,
+    'false': lambda env: False,
+    'count': lambda env, nodes: float(len(nodes)),
+    'string': lambda env, value: _string(value),
+    'normalize-space': lambda env, value: ' '.join(_string(value).split()),
+    'contains': lambda env, haystack, needle: _string(needle) in _string(haystack),
+    'starts-with': lambda env, string, prefix: _string(string).startswith(_string(prefix)),
+    'concat': lambda env, *values: ''.join(_string(value) for value in values),
+    'xpyth:member': lambda env, nodes, name: _member(nodes, name, env),
+    're:test': lambda env, string, pattern, flags='': bool(
+        re.search(_string(pattern), _string(string), re.IGNORECASE if 'i' in _string(flags) else 0)
+    ),
+}
+
+
+# Axes: functions from a context node to the (element) nodes along that axis, in document order
+
+def _children(node, env):
+    return list(node)
+
+
+def _descendants(node, env):
+    return [descendant for descendant in node.iter() if descendant is not node]
+
+
+def _descendants_or_self(node, env):
+    return list(node.iter())
+
+
+def _parent(node, env):
+    parent = env.parent(node)
+    return [] if parent is None else [parent]
+
+
+def _ancestors(node, env):
+    ancestors = []
+    parent = env.parent(node)
+    while parent is not None:
+        ancestors.append(parent)
+        parent = env.parent(parent)
+    return ancestors[::-1]
+
+
+def _siblings(following):
+    def axis(node, env):
+        parent = env.parent(node)
+        if parent is None:
+            return []
+        siblings = list(parent)
+        index = next(i for i, sibling in enumerate(siblings) if sibling is node)
+        return siblings[index + 1:] if following else siblings[:index]
+    return axis
+
+
+_AXES = {
+    'child': _children,
+    'descendant': _descendants,
+    'descendant-or-self': _descendants_or_self,
+    'self': lambda node, env: [node],
+    'parent': _parent,
+    'ancestor': _ancestors,
+    'ancestor-or-self': lambda node, env: _ancestors(node, env) + [node],
+    'following-sibling': _siblings(following=True),
+    'preceding-sibling': _siblings(following=False),
+}
+
+
+def _texts(node):
+    texts = [node.text] + [child.tail for child in node]
+    return [text for text in texts if text]
+
+
+def _text_nodes(element):
+    """(parent, text) for each text node within element, in document order."""
+    if element.text:
+        yield element, element.text
+    for child in element:
+        for text_node in _text_nodes(child):
+            yield text_node
+        if child.tail and not isinstance(element, _Document):
+            yield element, child.tail
+
+
+def _text_step(select, within):
+    """
+    Marks select as selecting text children, or, if within is set, all text
+    within the context node, so that _path() can gather them in document order.
+    """
+    select.within = within
+    return select
+
+
+def _step(axis, test, predicates):
+    """Compiles a location step into a function from a context node to the nodes it selects."""
+    if axis == 'attribute':
+        if test == '*':
+            select = lambda node, env: list(node.attrib.values())
+        else:
+            select = lambda node, env: [] if node.get(test) is None else [node.get(test)]
+    elif test == 'text()':
+        if axis == 'child':
+            select = _text_step(lambda node, env: _texts(node), within=False)
+        elif axis in ('descendant', 'descendant-or-self'):
+            select = _text_step(lambda node, env: [text for __, text in _text_nodes(node)], within=True)
+        else:
+            raise NotImplementedError(axis + '::text()')
+    elif test == 'node()':
+        select = _AXES[axis]
+    elif axis in ('descendant', 'descendant-or-self') and test != '*':
+        # Fast path: let ElementTree find elements by tag
+        include_self = axis == 'descendant-or-self'
+        select = lambda node, env: [
+            element
+            for element in node.iter(test)
+            if include_self or element is not node
+        ]
+    elif test == '*':
+        select = lambda node, env: [element for element in _AXES[axis](node, env) if _is_element(element)]
+    else:
+        select = lambda node, env: [element for element in _AXES[axis](node, env) if element.tag == test]
+
+    if not predicates:
+        return select
+
+    def step(node, env):
+        return [
+            selected
+            for selected in select(node, env)
+            if all(_boolean(predicate(selected, env)) for predicate in predicates)
+        ]
+    return step
+
+
+def _path(absolute, steps):
+    """Compiles a location path into a function from a context node to a node-set."""
+    def path(node, env):
+        nodes = [env.document if absolute else node]
+        for step in steps:
+            within = getattr(step, 'within', None)
+            if within is not None and len(nodes) > 1:
+                # Contexts' text nodes interleave with those of contexts within them
+                nodes = _texts_of(nodes, within, env)
+                continue
+            selected = []
+            seen = set()
+            for context in nodes:
+                for result in step(context, env):
+                    if isinstance(result, _STRING_TYPES):
+                        selected.append(result)
+                    elif id(result) not in seen:
+                        seen.add(id(result))
+                        selected.append(result)
+            if len(nodes) > 1 and selected and not isinstance(selected[0], _STRING_TYPES):
+                selected.sort(key=env.position)
+            nodes = selected
+        return nodes
+    return path
+
+
+def _texts_of(contexts, within, env):
+    """Text children (or, if within is set, all text within) of contexts, in document order."""
+    if within:
+        owners = {id(element) for context in contexts for element in context.iter()}
+    else:
+        owners = {id(context) for context in contexts}
+    return [text for parent, text in _text_nodes(env.root) if id(parent) in owners]
+
+
+class _Parser(object):
+    """Recursive descent parser for the subset of XPath 1.0 which xpyth generates."""
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = []
+        position = 0
+        expression = expression.rstrip()
+        while position < len(expression):
+            match = _TOKEN.match(expression, position)
+            if not match or match.end() == position:
+                raise NotImplementedError(expression)
+            self.tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            position = match.end()
+        self.index = 0
+
+    def peek(self, offset=0):
+        try:
+            return self.tokens[self.index + offset]
+        except IndexError:
+            return None, None
+
+    def take(self, value=None):
+        kind, token = self.peek()
+        if kind is None or value is not None and token != value:
+            raise NotImplementedError(self.expression)
+        self.index += 1
+        return token
+
+    def parse(self):
+        compiled = self.parse_or()
+        if self.index != len(self.tokens):
+            raise NotImplementedError(self.expression)
+        return compiled
+
+    def parse_or(self):
+        operands = [self.parse_and()]
+        while self.peek() == ('name', 'or'):
+            self.take()
+            operands.append(self.parse_and())
+        if len(operands) == 1:
+            return operands[0]
+        return lambda node, env: any(_boolean(operand(node, env)) for operand in operands)
+
+    def parse_and(self):
+        operands = [self.parse_comparison()]
+        while self.peek() == ('name', 'and'):
+            self.take()
+            operands.append(self.parse_comparison())
+        if len(operands) == 1:
+            return operands[0]
+        return lambda node, env: all(_boolean(operand(node, env)) for operand in operands)
+
+    def parse_comparison(self):
+        left = self.parse_operand()
+        kind, token = self.peek()
+        if kind == 'op' and token in _COMPARISONS:
+            self.take()
+            right = self.parse_operand()
+            return lambda node, env: _compare(token, left(node, env), right(node, env))
+        return left
+
+    def parse_operand(self):
+        kind, token = self.peek()
+        if kind == 'literal':
+            self.take()
+            value = token[1:-1]
+            return lambda node, env: value
+        if kind == 'number':
+            self.take()
+            value = float(token)
+            return lambda node, env: value
+        if token == '$':
+            self.take()
+            name = self.take()
+            return lambda node, env: _literal_value(env.bindings[name])
+        if token == '(':
+            self.take()
+            inner = self.parse_or()
+            self.take(')')
+            return inner
+        if kind == 'name' and self.peek(1)[1] == '(' and token not in _NODE_TYPES:
+            return self.parse_function()
+        return self.parse_path()
+
+    def parse_function(self):
+        name = self.take()
+        if name not in _FUNCTIONS:
+            raise NotImplementedError(name)
+        function = _FUNCTIONS[name]
+        self.take('(')
+        arguments = []
+        while self.peek()[1] != ')':
+            arguments.append(self.parse_or())
+            if self.peek()[1] == ',':
+                self.take()
+        self.take(')')
+        return lambda node, env: function(env, *[argument(node, env) for argument in arguments])
+
+    def parse_path(self):
+        absolute = self.peek()[1] in ('/', '//')
+        steps = []
+        separator = None
+        if not absolute:
+            steps.append(self.parse_step(separator))
+        while self.peek()[1] in ('/', '//'):
+            separator = self.take()
+            if separator == '/' and not steps and self.peek()[0] is None:
+                break  # the document itself
+            steps.append(self.parse_step(separator))
+        return _path(absolute, steps)
+
+    def parse_step(self, separator):
+        kind, token = self.peek()
+        if token == '.':
+            self.take()
+            axis, test = 'self', 'node()'
+        elif token == '..':
+            self.take()
+            axis, test = 'parent', 'node()'
+        elif token == '@':
+            self.take()
+            axis, test = 'attribute', self.take()
+        elif kind == 'name' and self.peek(1)[1] == '::':
+            axis = self.take()
+            self.take('::')
+            test = self.parse_node_test()
+            if axis not in _AXES:
+                raise NotImplementedError(axis)
+        else:
+            axis, test = 'child', self.parse_node_test()
+
+        predicates = []
+        while self.peek()[1] == '[':
+            self.take()
+            predicates.append(self.parse_predicate())
+            self.take(']')
+
+        if separator == '//':
+            if axis == 'child':
+                axis = 'descendant'
+            elif axis in ('self', 'attribute') or test == 'text()':
+                if test == 'text()' and axis == 'child' and not predicates:
+                    return _step('descendant', test, predicates)  # the same text nodes, in document order
+                inner = _step(axis, test, predicates)
+                return lambda node, env: [
+                    selected
+                    for descendant in _descendants_or_self(node, env)
+                    for selected in inner(descendant, env)
+                ]
+            else:
+                raise NotImplementedError(self.expression)
+        return _step(axis, test, predicates)
+
+    def parse_node_test(self):
+        kind, token = self.peek()
+        if token == '*':
+            self.take()
+            return '*'
+        if kind != 'name':
+            raise NotImplementedError(self.expression)
+        self.take()
+        if token in _NODE_TYPES and self.peek()[1] == '(':
+            self.take('(')
+            self.take(')')
+            return token + '()'
+        return token
+
+    def parse_predicate(self):
+        kind, token = self.peek()
+        if kind == 'number' or token in ('position', 'last'):
+            raise NotImplementedError('Positional predicates are not supported: ' + self.expression)
+        return self.parse_or()
+
+
+def _literal_value(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    return _text(value)
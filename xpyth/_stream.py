@@ -0,0 +1,80 @@
+"""Incremental evaluation of comprehensions over documents too large to hold in memory."""
+
+from xpyth import xpath, _evaluator, etree
+from xpyth import _paths
+
+_AXES = {
+    '/': 'parent',
+    '//': 'ancestor',
+}
+
+
+def _matcher(expression):
+    """
+    Compiles a forward-only location path into (tag, check, projection, keeps_text), where
+    check is an evaluator that, applied to an element as it ends, tells whether it matches.
+    """
+    steps = _paths.steps(expression)
+    projection = None
+    if steps[-1][1].startswith('@') or steps[-1][1] == 'text()':
+        projection = steps.pop()[1]
+    if not steps:
+        raise NotImplementedError(expression)
+
+    condition = None
+    for i, (separator, step) in enumerate(steps):
+        test, predicates = _paths.node_test(step)
+        final = i == len(steps) - 1
+        if separator not in _AXES or not _paths.is_name(test):
+            raise NotImplementedError(step)
+        for predicate in predicates:
+            if not _paths.is_node_local(predicate):
+                raise NotImplementedError(predicate)
+            if not final and _paths.uses_text(predicate):
+                raise NotImplementedError(predicate)  # ancestors' text isn't complete until they end
+        if condition is None:
+            condition = step if separator == '//' else step + '[not(parent::*)]'
+        else:
+            condition = '{}[{}::{}]'.format(step, _AXES[separator], condition)
+
+    keeps_text = projection == 'text()' or any(_paths.uses_text(predicate) for predicate in predicates)
+    if keeps_text and test == '*':
+        # Any open element could still match, so none of their children could be discarded, as
+        # their tails are the open elements' text: memory would grow with the whole document
+        raise NotImplementedError("Streaming the text of any element (*) isn't supported; name its tag instead.")
+    return test, _evaluator('self::' + condition), projection, keeps_text
+
+
+def stream_query(g, source, **iterparse_options):
+    """
+    Queries an XML document incrementally, yielding matches as their elements end.
+
+    Only child and descendant steps are supported, and only the final step may
+    have predicates which look at text. Elements are cleared once iteration moves
+    past them, so memory use doesn't grow with the size of the document - which
+    also means that yielded elements lose their contents once iteration resumes.
+    """
+    tag, check, projection, keeps_text = _matcher(xpath(g))
+    texts = _evaluator('text()', smart_strings=False)
+
+    for __, element in etree.iterparse(source, events=('end',), **iterparse_options):
+        if (tag == '*' or element.tag == tag) and check(element):
+            if projection is None:
+                yield element
+            elif projection == 'text()':
+                for text in texts(element):
+                    yield text
+            else:
+                value = element.get(projection[1:])
+                if value is not None:
+                    yield value
+
+        # Discard everything we've already seen, bar the tails of children whose parent may still match
+        tail = element.tail
+        element.clear()
+        element.tail = tail
+        parent = element.getparent()
+        if parent is None or keeps_text and (tag == '*' or parent.tag == tag):
+            continue
+        while element.getprevious() is not None:
+            del parent[0]
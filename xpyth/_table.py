@@ -0,0 +1,78 @@
+"""
+Extraction of several fields per matched element, as columns.
+
+The elements are selected by a single evaluation of the comprehension's
+translation, after which each field is read from all of them, a column at a time.
+Within fields, as within conditions left to Python, attributes of the
+comprehension's node read as the element's attribute values (or text), missing
+ones as empty strings.
+"""
+
+from xpyth import (
+    _assigned_names, _is_lxml, _LRUCache, _Namespace, _query, _referenced_names, _residual, _stdlib, _SCALAR_TYPES,
+)
+from xpyth._decompiler import decompile
+from xpyth._nodes import Tuple
+
+
+_columns = _LRUCache()  # code object -> [column functions]
+
+
+def _column(field, target):
+    """Function (elements, namespace) -> the field's value for each element."""
+    name = _residual.attribute(field, target)
+    if name == 'text':
+        return lambda elements, namespace: [element.text or '' for element in elements]
+    if name is not None:
+        return lambda elements, namespace: [element.get(name, '') for element in elements]
+    value = _residual.value(field, target)
+    return lambda elements, namespace: [value(element, namespace) for element in elements]
+
+
+def columns(code):
+    """Functions (elements, namespace) -> each field's values, for a comprehension of tuples."""
+    compiled = _columns.get(code)
+    if compiled is None:
+        inner = decompile(code).code
+        row, fors = inner.expr, inner.quals
+        if row.__class__ != Tuple:
+            raise NotImplementedError("query_table() takes a comprehension of tuples, e.g. ((a.href, a.text) for a in tree).")
+        target = fors[-1].assign.name
+        others = _assigned_names(inner) - {target}
+        for field in row.nodes:
+            if _referenced_names(field) & others:
+                raise NotImplementedError(field)  # only the selected node's fields can be read
+        compiled = [_column(field, target) for field in row.nodes]
+        _columns.put(code, compiled)
+    return compiled
+
+
+def _array(numpy, column):
+    if all(isinstance(value, _SCALAR_TYPES) for value in column):
+        return numpy.array(column)
+    array = numpy.empty(len(column), dtype=object)  # e.g. elements, which numpy would take for sequences
+    array[:] = column
+    return array
+
+
+def query_table(g, variables=False, membership=False, index=None, arrays=False):
+    """
+    Queries a DOM tree (lxml or xml.etree Element) with a comprehension of
+    tuples, e.g. ((a.href, a.text) for a in tree if ...), returning a tuple of
+    columns: a list of each field's values, one per element, in document order.
+
+    The elements are selected once, however many fields there are. If arrays
+    is set, the columns are NumPy arrays instead (which requires NumPy).
+    variables, membership and index are as for query().
+    """
+    if arrays:
+        import numpy
+    compiled = columns(g.gi_code)
+    namespace = _Namespace(g.gi_frame)
+    elements = _query(g, variables, membership, smart_strings=False, index=index)
+    if elements and not (_is_lxml(elements[0]) or _stdlib.is_element(elements[0])):
+        raise NotImplementedError(elements[0].__class__.__name__)
+    table = tuple(column(elements, namespace) for column in compiled)
+    if arrays:
+        return tuple(_array(numpy, column) for column in table)
+    return table